@@ -87,8 +87,18 @@ MENDER_SETUP_CLI="mender-setup"
 # Path where to install the Mender APT repository
 MENDER_APT_SOURCES_LIST="/etc/apt/sources.list.d/mender.list"
 
-# URL prefix for the commercial components
-MENDER_COMMERCIAL_DOWNLOAD_URL="https://downloads.customer.mender.io/content/hosted/"
+# Path where to install the Mender APT repository key, only trusted for the
+# Mender APT repository through signed-by. APT reads the ASCII armored key
+# as is, no gnupg needed.
+MENDER_APT_KEYRING="/etc/apt/keyrings/mender.asc"
+
+# Path where the Mender APT repository key was installed in the past, trusted
+# for all the repositories
+MENDER_APT_KEY_DEPRECATED="/etc/apt/trusted.gpg.d/mender.asc"
+
+# URL prefix for the commercial components, can be overridden from the
+# environment to use a mirror
+MENDER_COMMERCIAL_DOWNLOAD_URL="${MENDER_COMMERCIAL_DOWNLOAD_URL:-https://downloads.customer.mender.io/content/hosted/}"
 
 # URL path for the commercial components, formatted by version, distribution and release
 ARCHITECTURE=$(dpkg --print-architecture)
@@ -98,6 +108,11 @@ declare -A COMMERCIAL_COMP_TO_URL_PATH_F=(
   [mender-monitor-demo]="mender-monitor/debian/%s/mender-monitor-demo_%s-1+%s+%s_all.deb"
 )
 
+# Directory where the verified commercial downloads are kept, in the same layout
+# as the download URLs, so that they are downloaded only once per version,
+# except for master
+MENDER_INSTALL_CACHE="/var/cache/mender-install"
+
 # URL path for mender-gateway demo, formatted by version
 MENDER_GATEWAY_EXAMPLES_URL_PATH_F="mender-gateway/examples/%s/mender-gateway-examples-%s.tar"
 
@@ -108,6 +123,17 @@ MENDER_GATEWAY_LATEST_VERSION="2.0.0"
 
 export DEBIAN_FRONTEND=noninteractive
 
+# Temporary directories removed on exit
+TEMP_DIRS=()
+
+# Set to 1 once the package lists are updated, see apt_get
+APT_UPDATED=0
+
+# Durations of the phases of the installation, as "phase milliseconds"
+PHASES=()
+CURRENT_PHASE=""
+START_TIME=$(date +%s%N)
+
 banner (){
     echo "
                           _
@@ -132,11 +158,22 @@ usage() {
     echo "  --commercial           install commercial components, requires --jwt-token"
     echo "  --force-mender-client4 install the Mender Client 4.x series on all the distros"
     echo "  --jwt-token TOKEN      Hosted Mender JWT token"
+    echo "  --create-bundle FILE   download the selected components and their dependencies"
+    echo "                         into the offline bundle FILE instead of installing them"
+    echo "  --bundle FILE          install the components of the offline bundle FILE, without"
+    echo "                         network access"
+    echo "  --json-summary FILE    write the duration of each step, the installed versions and"
+    echo "                         the downloaded bytes to FILE as JSON when the script exits"
     echo ""
     echo "If no components are specified, defaults will be installed"
     echo ""
     echo "Anything after a '--' gets passed directly to the client setup tool."
     echo ""
+    echo "An offline bundle is created on a system with the same distribution, release"
+    echo "and architecture as the devices it is meant for. It has all the dependencies of"
+    echo "the components, and can then be installed on many devices at once without"
+    echo "apt-get update nor downloads."
+    echo ""
     echo "This script will install the Mender Client 3.x series on Ubuntu jammy or older, "
     echo "and on Debian bullseye or older. On newer distributions, it will install the "
     echo "Mender Client 4.x series. If you want to force the installation of the latest "
@@ -218,6 +255,23 @@ parse_args() {
                 ;;
             --force-mender-client4)
                 ;;
+            --create-bundle|--bundle|--json-summary)
+                if [ -n "$2" ]; then
+                    if [ "$1" = "--bundle" ]; then
+                        BUNDLE="$(realpath "$2")"
+                    elif [ "$1" = "--json-summary" ]; then
+                        JSON_SUMMARY="$(realpath -m "$2")"
+                        DOWNLOAD_STATS="$(mktemp)"
+                    else
+                        CREATE_BUNDLE="$(realpath -m "$2")"
+                    fi
+                    shift
+                else
+                    echo "ERROR: ${1#--} requires a non-empty option argument."
+                    echo "Aborting."
+                    exit 1
+                fi
+                ;;
             --)
                 shift
                 MENDER_SETUP_ARGS="$@"
@@ -283,7 +337,8 @@ function get_latest_version_of_commercial_component() {
 }
 
 init() {
-    REPO_URL=https://downloads.mender.io/repos/device-components
+    # Can be overridden from the environment to use a mirror
+    REPO_URL="${MENDER_REPO_URL:-https://downloads.mender.io/repos/device-components}"
 
     parse_args "$@"
 
@@ -305,14 +360,41 @@ init() {
     printf "\t%s\n" "$VERSION"
 }
 
+# Runs apt-get with the given arguments, recording the bytes it reports as
+# fetched, and whether the package lists were updated in APT_UPDATED
+apt_get() {
+    local rc=0
+    if [ -z "$DOWNLOAD_STATS" ]; then
+        apt-get "$@" || rc=$?
+    else
+        LC_ALL=C apt-get "$@" | tee "$DOWNLOAD_STATS.apt"
+        rc=${PIPESTATUS[0]}
+        awk '/^Fetched / {
+            n = $2; gsub(",", "", n)
+            m = ($3 == "kB") ? 1000 : ($3 == "MB") ? 1000000 : ($3 == "GB") ? 1000000000 : 1
+            printf "%d\n", n * m
+        }' "$DOWNLOAD_STATS.apt" >> "$DOWNLOAD_STATS"
+        rm -f "$DOWNLOAD_STATS.apt"
+    fi
+    if [ $rc -eq 0 ] && [ "$1" = "update" ]; then
+        APT_UPDATED=1
+    fi
+    return $rc
+}
+
+# Installs the tools missing for the downloads: curl, for the repository key and
+# the commercial components, and the CA certificates, for curl and for APT over
+# HTTPS. apt-transport-https is built into APT on all the supported releases.
 get_deps() {
-    apt-get update -qq
-    apt-get install -y -qq --no-install-recommends \
-        apt-transport-https \
-        ca-certificates \
-        curl \
-        gnupg \
-        jq
+    local deps=""
+    command_exists curl || deps="$deps curl"
+    [ -r /etc/ssl/certs/ca-certificates.crt ] || deps="$deps ca-certificates"
+
+    if [ -z "$deps" ]; then
+        return
+    fi
+    apt_get update -qq
+    apt_get install -y -qq --no-install-recommends $deps
 }
 
 maybe_remove_existing_gpg_key() {
@@ -327,8 +409,14 @@ maybe_remove_existing_gpg_key() {
 }
 
 add_repo() {
+    rm -f "$MENDER_APT_KEY_DEPRECATED"
     maybe_remove_existing_gpg_key
-    curl -fsSL $REPO_URL/gpg | tee /etc/apt/trusted.gpg.d/mender.asc
+    mkdir -p "$(dirname "$MENDER_APT_KEYRING")"
+    if [ -n "$BUNDLE_DIR" ]; then
+        cp "$BUNDLE_DIR/mender.asc" "$MENDER_APT_KEYRING"
+    else
+        curl -fsSL $REPO_URL/gpg | tee "$MENDER_APT_KEYRING"
+    fi
 
     local repo_deprecated="deb [arch=$ARCH] $REPO_URL $CHANNEL main"
     if grep -F "$repo_deprecated" /etc/apt/sources.list >/dev/null; then
@@ -345,7 +433,7 @@ add_repo() {
         exit 1
     fi
 
-    local repo="deb [arch=$ARCH] $REPO_URL $LSB_DIST/$DIST_VERSION/$CHANNEL main"
+    local repo="deb [arch=$ARCH signed-by=$MENDER_APT_KEYRING] $REPO_URL $LSB_DIST/$DIST_VERSION/$CHANNEL main"
     echo "Installing Mender APT repository at $MENDER_APT_SOURCES_LIST..."
     echo "$repo" > "$MENDER_APT_SOURCES_LIST"
 }
@@ -366,8 +454,8 @@ do_install_open() {
 
     echo "  Installing open source components from APT repository"
 
-    apt-get update
-    apt-get install -y \
+    apt_get update
+    apt_get install -y \
        -o Dpkg::Options::="--force-confdef" \
        -o Dpkg::Options::="--force-confold" \
        $selected_components_open
@@ -375,6 +463,113 @@ do_install_open() {
     echo "  Success! Please run \``mender_setup_cli`\` as superuser to configure the client."
 }
 
+# $1 - The commercial component
+# Prints the download URL of the component for the selected version
+commercial_component_url() {
+    local component_version="$VERSION"
+    [ "$component_version" = "latest" ] && component_version="$(get_latest_version_of_commercial_component $1)"
+    echo "${MENDER_COMMERCIAL_DOWNLOAD_URL}$(printf ${COMMERCIAL_COMP_TO_URL_PATH_F[$1]} $component_version $component_version $LSB_DIST $DIST_VERSION)"
+}
+
+# Prints the download URL of the mender-gateway examples for the selected version
+gateway_examples_url() {
+    local gateway_version="$VERSION"
+    [ "$gateway_version" = "latest" ] && gateway_version="$(get_latest_version_of_commercial_component mender-gateway)"
+    echo "${MENDER_COMMERCIAL_DOWNLOAD_URL}$(printf ${MENDER_GATEWAY_EXAMPLES_URL_PATH_F} $gateway_version $gateway_version)"
+}
+
+# $1 - A downloaded file
+# $2 - Its published SHA-256 checksum, empty when none is published
+is_valid_download() {
+    if [ -n "$2" ] && [ "$(sha256sum "$1" | cut -d' ' -f1)" != "$2" ]; then
+        return 1
+    fi
+    case "$1" in
+        *.deb|*.deb.part)
+            dpkg-deb --info "$1" >/dev/null 2>&1 && \
+                dpkg-deb --fsys-tarfile "$1" >/dev/null 2>&1
+            ;;
+        *)
+            tar -tf "$1" >/dev/null 2>&1
+            ;;
+    esac
+}
+
+# $1 - URL of a commercial file
+# Downloads the file to the cache, resuming the partial download of an earlier
+# attempt, and only keeps it once verified against the checksum published next
+# to it as <file>.sha256. Cached and partial files are only trusted when the
+# checksum is published, otherwise the file is downloaded again from scratch.
+# The files of the master version are rebuilt under the same URL, so they are
+# downloaded again on every run. Prints the path of the file.
+download_commercial_file() {
+    local -r url="$1"
+    local -r dest="$MENDER_INSTALL_CACHE/${url#"$MENDER_COMMERCIAL_DOWNLOAD_URL"}"
+    local attempt
+    local checksum
+    mkdir -p "$(dirname "$dest")"
+    checksum="$(curl -fLsS -H "Authorization: Bearer $JWT_TOKEN" "$url.sha256" 2>/dev/null | cut -d' ' -f1)" || true
+    [[ "$checksum" =~ ^[0-9a-f]{64}$ ]] || checksum=""
+    if [ -z "$checksum" ]; then
+        echo >&2 "WARNING: No checksum published for ${url##*/}, downloading it again and only checking its integrity"
+    fi
+    if [ "$VERSION" = "master" ] || [ -z "$checksum" ]; then
+        rm -f "$dest" "$dest.part"
+    elif [ -f "$dest" ] && ! is_valid_download "$dest" "$checksum"; then
+        rm -f "$dest"
+    fi
+    if [ ! -f "$dest" ]; then
+        for attempt in 1 2 3; do
+            # A partial download can only be resumed when it is verified
+            # afterwards
+            [ -n "$checksum" ] || rm -f "$dest.part"
+            if curl -fLsS -C - -H "Authorization: Bearer $JWT_TOKEN" -o "$dest.part" \
+                    -w '%{size_download}\n' "$url" >> "${DOWNLOAD_STATS:-/dev/null}"; then
+                if is_valid_download "$dest.part" "$checksum"; then
+                    mv "$dest.part" "$dest"
+                    break
+                fi
+                # Complete but corrupted, cannot be resumed
+                rm -f "$dest.part"
+            fi
+        done
+        if [ ! -f "$dest" ]; then
+            echo >&2 "ERROR: Cannot get ${url##*/} from $url"
+            return 1
+        fi
+    fi
+    echo "$dest"
+}
+
+# $@ - URLs of commercial files
+# Downloads the files in parallel, see download_commercial_file, and sets
+# DOWNLOADED_FILES to their paths
+download_commercial_files() {
+    local -r results="$(mktemp -d)"
+    TEMP_DIRS+=("$results")
+    local -a pids=()
+    local i=0
+    local url
+    for url in "$@"; do
+        download_commercial_file "$url" > "$results/$i" &
+        pids+=($!)
+        i=$((i + 1))
+    done
+
+    local failed=0
+    local pid
+    for pid in "${pids[@]}"; do
+        wait $pid || failed=1
+    done
+
+    DOWNLOADED_FILES=()
+    for ((i = 0; i < ${#pids[@]}; i++)); do
+        DOWNLOADED_FILES+=("$(cat "$results/$i")")
+    done
+    rm -rf "$results"
+    [ $failed -eq 0 ] || exit 1
+}
+
 do_install_commercial() {
     # Filter commercial components
     local selected_components_commercial=""
@@ -393,31 +588,25 @@ do_install_commercial() {
     echo "  Installing commercial components from $MENDER_COMMERCIAL_DOWNLOAD_URL"
 
     # Download deb packages
-    local url
+    local -a urls=()
     for c in $selected_components_commercial; do
-        local component_version="$VERSION"
-        [ "$component_version" = "latest" ] && component_version="$(get_latest_version_of_commercial_component ${c})"
-        echo "Installing ${c} (${component_version})"
-        url="${MENDER_COMMERCIAL_DOWNLOAD_URL}$(printf ${COMMERCIAL_COMP_TO_URL_PATH_F[$c]} $component_version $component_version $LSB_DIST $DIST_VERSION)"
-        if ! curl -fLsS -H "Authorization: Bearer $JWT_TOKEN" -O "$url"; then
-            echo "ERROR: Cannot get $c from $url"
-            exit 1
-        fi
+        urls+=("$(commercial_component_url ${c})")
+        echo "Installing ${c} (${urls[-1]##*/})"
     done
+    download_commercial_files "${urls[@]}"
 
-    # Install all of them at once and fallback to install missing dependencies
-    local -r deb_packages_glob=$(echo $selected_components_commercial | sed -e 's/ /*.deb /g; s/$/*.deb/')
-    local -r deb_packages_expanded=$(echo $deb_packages_glob | tr ' ' '\n' | sort | uniq )
-    dpkg --install $deb_packages_expanded || apt-get -f -y install
+    # Install all of them at once and fallback to install missing dependencies,
+    # which needs the package lists when no open source component was installed
+    if ! dpkg --install "${DOWNLOADED_FILES[@]}"; then
+        [ "$APT_UPDATED" = "1" ] || apt_get update
+        apt_get -f -y install
+    fi
 
     # Check individually each package
     for c in $selected_components_commercial; do
         dpkg --status $c || { echo ERROR: $c could not be installed; exit 1; }
     done
 
-    # Remove packages from working dir
-    rm $deb_packages_expanded
-
     echo "  Success!"
 }
 
@@ -462,25 +651,219 @@ EOF
     if [[ "$SELECTED_COMPONENTS" == *"mender-gateway"* ]]; then
         if [ "$DEMO" -eq 1 ]; then
             echo "  Setting up mender-gateway with demo configuration, certificates and key"
-            local gateway_version="$VERSION"
-            [ "$gateway_version" = "latest" ] && gateway_version="$(get_latest_version_of_commercial_component mender-gateway)"
-            local url="${MENDER_COMMERCIAL_DOWNLOAD_URL}$(printf ${MENDER_GATEWAY_EXAMPLES_URL_PATH_F} $gateway_version $gateway_version)"
-            if ! curl -fLsS -H "Authorization: Bearer $JWT_TOKEN" -O "$url"; then
-                echo "ERROR: Cannot get mender-gateway-examples from $url"
-                exit 1
+            local url="$(gateway_examples_url)"
+            local examples="$BUNDLE_DIR/${url##*/}"
+            if [ -z "$BUNDLE_DIR" ]; then
+                download_commercial_files "$url"
+                examples="${DOWNLOADED_FILES[0]}"
             fi
-            tar -C / --strip-components=2 -xvf mender-gateway-examples-${gateway_version}.tar
+            tar -C / --strip-components=2 -xvf "$examples"
 
             pidof systemd && systemctl restart mender-gateway
 
-            # Remove examples package from working dir
-            rm mender-gateway-examples-${gateway_version}.tar
-
             echo "  Success!"
         fi
     fi
 }
 
+# Downloads the selected components, open source and commercial, together with
+# all their dependencies, and packs them with the repository key and the
+# mender-gateway examples into the bundle $CREATE_BUNDLE
+create_bundle() {
+    local -r bundle_dir="$(mktemp -d)"
+    TEMP_DIRS+=("$bundle_dir")
+    mkdir -p "$bundle_dir/debs/partial"
+
+    echo "  Creating offline bundle $CREATE_BUNDLE"
+
+    cp "$MENDER_APT_KEYRING" "$bundle_dir/mender.asc"
+
+    local packages=""
+    local -a urls=()
+    local c
+    for c in $SELECTED_COMPONENTS; do
+        if is_commercial_component "$c"; then
+            urls+=("$(commercial_component_url ${c})")
+            echo "Downloading ${c} (${urls[-1]##*/})"
+            packages="$packages $bundle_dir/debs/${urls[-1]##*/}"
+        else
+            packages="$packages $c"
+        fi
+    done
+    if [[ "$SELECTED_COMPONENTS" == *"mender-gateway"* ]] && [ "$DEMO" -eq 1 ]; then
+        urls+=("$(gateway_examples_url)")
+    fi
+
+    if [ ${#urls[@]} -gt 0 ]; then
+        download_commercial_files "${urls[@]}"
+        local file
+        for file in "${DOWNLOADED_FILES[@]}"; do
+            case "$file" in
+                *.deb) cp "$file" "$bundle_dir/debs/" ;;
+                *) cp "$file" "$bundle_dir/" ;;
+            esac
+        done
+    fi
+
+    # Resolve and download the components and their dependencies, the
+    # commercial packages being given as files. They are resolved against an
+    # empty package database, so that the dependencies already installed on
+    # this system, but maybe not on the devices, are in the bundle too.
+    : > "$bundle_dir/status"
+    apt_get update
+    apt_get install -y --download-only \
+        -o Dir::State::status="$bundle_dir/status" \
+        -o Dir::Cache::pkgcache= \
+        -o Dir::Cache::srcpkgcache= \
+        -o Dir::Cache::archives="$bundle_dir/debs/" \
+        $packages
+    rm -rf "$bundle_dir/status" "$bundle_dir/debs/partial" "$bundle_dir/debs/lock"
+
+    cat > "$bundle_dir/bundle.conf" << EOF
+BUNDLE_LSB_DIST="$LSB_DIST"
+BUNDLE_DIST_VERSION="$DIST_VERSION"
+BUNDLE_ARCH="$ARCH"
+BUNDLE_CHANNEL="$CHANNEL"
+BUNDLE_COMPONENTS="$(echo $SELECTED_COMPONENTS)"
+BUNDLE_DEMO="$DEMO"
+EOF
+
+    tar -C "$bundle_dir" -cf "$CREATE_BUNDLE" .
+    echo "  Success! $(ls "$bundle_dir/debs" | wc -l) packages written to $CREATE_BUNDLE"
+}
+
+# Extracts the bundle $BUNDLE and selects its components
+extract_bundle() {
+    BUNDLE_DIR="$(mktemp -d)"
+    TEMP_DIRS+=("$BUNDLE_DIR")
+    tar -C "$BUNDLE_DIR" -xf "$BUNDLE"
+    . "$BUNDLE_DIR/bundle.conf"
+
+    if [ "$BUNDLE_LSB_DIST/$BUNDLE_DIST_VERSION/$BUNDLE_ARCH" != "$LSB_DIST/$DIST_VERSION/$ARCH" ]; then
+        echo "ERROR: the bundle is for $BUNDLE_LSB_DIST/$BUNDLE_DIST_VERSION/$BUNDLE_ARCH, not for $LSB_DIST/$DIST_VERSION/$ARCH."
+        echo "Aborting."
+        exit 1
+    fi
+
+    CHANNEL="$BUNDLE_CHANNEL"
+    SELECTED_COMPONENTS="$BUNDLE_COMPONENTS"
+    DEMO="$BUNDLE_DEMO"
+    echo "  Installing from offline bundle $BUNDLE"
+}
+
+do_install_bundle() {
+    # All the dependencies are in the bundle, install them as files so that
+    # APT needs no package lists. The packages already installed at the same
+    # or a newer version are left alone.
+    local deb
+    local package
+    local version
+    local installed
+    local -a debs=()
+    local dependencies=""
+    for deb in "$BUNDLE_DIR"/debs/*.deb; do
+        read -r package version <<< "$(dpkg-deb --show --showformat='${Package} ${Version}' "$deb")"
+        installed="$(dpkg-query --show --showformat='${db:Status-Status} ${Version}' "$package" 2>/dev/null || true)"
+        if [ "${installed%% *}" = "installed" ] && \
+                dpkg --compare-versions "${installed#* }" ge "$version"; then
+            continue
+        fi
+        debs+=("$deb")
+        # Only the selected components are marked as manually installed, the
+        # packages upgraded from the bundle keep their mark
+        if [ "${installed%% *}" != "installed" ] && \
+                ! echo " $SELECTED_COMPONENTS " | grep -q " $package "; then
+            dependencies="$dependencies $package"
+        fi
+    done
+
+    if [ ${#debs[@]} -gt 0 ]; then
+        apt-get install -y \
+           -o Dpkg::Options::="--force-confdef" \
+           -o Dpkg::Options::="--force-confold" \
+           "${debs[@]}"
+    fi
+    [ -z "$dependencies" ] || apt-mark auto $dependencies >/dev/null
+
+    local c
+    for c in $SELECTED_COMPONENTS; do
+        dpkg --status $c >/dev/null || { echo ERROR: $c could not be installed; exit 1; }
+    done
+
+    echo "  Success! Please run \``mender_setup_cli`\` as superuser to configure the client."
+}
+
+# $1 - The phase, a function of this script
+# $@ - The arguments of the function
+run_phase() {
+    local -r phase="$1"
+    shift
+    local -r start=$(date +%s%N)
+    CURRENT_PHASE="$phase"
+    "$phase" "$@"
+    CURRENT_PHASE=""
+    PHASES+=("$phase $(( ($(date +%s%N) - start) / 1000000 ))")
+}
+
+write_json_summary() {
+    local -r exit_code="$1"
+    local exit_reason="success"
+    if [ "$exit_code" -ne 0 ]; then
+        exit_reason="failed${CURRENT_PHASE:+ in $CURRENT_PHASE}"
+    fi
+
+    local phases=""
+    local entry
+    for entry in "${PHASES[@]}"; do
+        phases="$phases${phases:+,}
+    {\"name\": \"${entry% *}\", \"duration_ms\": ${entry#* }}"
+    done
+
+    local components=""
+    local c
+    local version
+    for c in $SELECTED_COMPONENTS; do
+        version="$(dpkg-query --show --showformat='${Version}' "$c" 2>/dev/null || true)"
+        if [ -n "$version" ]; then
+            version="\"$version\""
+        else
+            version="null"
+        fi
+        components="$components${components:+,}
+    \"$c\": $version"
+    done
+
+    local bytes=0
+    if [ -s "$DOWNLOAD_STATS" ]; then
+        bytes=$(awk '{ s += $1 } END { printf "%d", s }' "$DOWNLOAD_STATS")
+    fi
+
+    cat > "$JSON_SUMMARY" << EOF
+{
+  "exit_code": $exit_code,
+  "exit_reason": "$exit_reason",
+  "distribution": "$LSB_DIST/$DIST_VERSION",
+  "architecture": "$ARCH",
+  "channel": "$CHANNEL",
+  "duration_ms": $(( ($(date +%s%N) - START_TIME) / 1000000 )),
+  "phases": [$phases
+  ],
+  "components": {$components
+  },
+  "bytes_downloaded": $bytes
+}
+EOF
+}
+
+on_exit() {
+    local -r exit_code=$?
+    if [ -n "$JSON_SUMMARY" ]; then
+        write_json_summary $exit_code || echo "WARNING: cannot write $JSON_SUMMARY"
+        rm -f "$DOWNLOAD_STATS"
+    fi
+    rm -rf "${TEMP_DIRS[@]}"
+}
+
 command_exists() {
     command -v "$@" > /dev/null 2>&1
 }
@@ -630,15 +1013,30 @@ check_dist_and_version() {
     fi
 }
 
+trap on_exit EXIT
+
 banner
-check_dist_and_version
+run_phase check_dist_and_version
 init "$@"
+if [ -n "$BUNDLE" ]; then
+    run_phase extract_bundle
+fi
 print_components
-get_deps
-add_repo
-do_install_open
-do_install_commercial
-do_setup_mender_client
-do_setup_other_components
+if [ -n "$CREATE_BUNDLE" ]; then
+    run_phase get_deps
+    run_phase add_repo
+    run_phase create_bundle
+    exit 0
+elif [ -n "$BUNDLE" ]; then
+    run_phase add_repo
+    run_phase do_install_bundle
+else
+    run_phase get_deps
+    run_phase add_repo
+    run_phase do_install_open
+    run_phase do_install_commercial
+fi
+run_phase do_setup_mender_client
+run_phase do_setup_other_components
 
 exit 0
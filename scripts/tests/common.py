@@ -16,16 +16,23 @@
 import glob
 import http.server
 import os
-import socketserver
+import re
+import shutil
 import subprocess
 import threading
+import urllib.error
+import urllib.parse
+import urllib.request
 
 import pytest
 
-from tests.mender_test_containers.helpers import Result as SSHResult
+from tests.apt_repo import apt_repo_archive, enable_local_apt_repo
+from tests.helpers import check_installed_many
 
 SCRIPT_SERVER_ADDR = "localhost"
-SCRIPT_SERVER_PORT = 8000
+# The test containers use the host network, so each pytest-xdist worker serves
+# the scripts on its own port
+SCRIPT_SERVER_PORT = 8000 + int(os.getenv("PYTEST_XDIST_WORKER", "gw0")[2:])
 SCRIPT_SERVER_PATH = os.path.join(os.path.dirname(__file__), "..")
 
 # Fetch the distro type from the CI: debian, ubuntu
@@ -42,53 +49,188 @@ REF_PACKAGES = os.path.join(
 )
 
 
-def check_installed(conn, pkg, installed=True):
-    """Check whether the given package is installed on the device given by conn.
-    Check the specific dpkg Status to differentiate between installed (install ok installed)
-    and other status like removed but not purged (deinstall ok config-files)"""
+# Servers mirrored by the script server, by path prefix
+MIRROR_UPSTREAMS = {
+    "/repos/": "https://downloads.mender.io/repos/",
+    "/content/hosted/": "https://downloads.customer.mender.io/content/hosted/",
+}
+
+# Persistent cache of the mirrored files, in the layout of the URL paths
+MIRROR_POOL = os.getenv(
+    "MENDER_TEST_MIRROR_POOL", os.path.expanduser("~/.cache/mender-test-mirror")
+)
+
+# Environment pointing install-mender.sh to the mirror
+MIRROR_ENV = (
+    f"MENDER_REPO_URL=http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/repos/device-components "
+    f"MENDER_COMMERCIAL_DOWNLOAD_URL=http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/content/hosted/"
+)
 
-    res = conn.run(f"dpkg --status {pkg}", warn=True)
-    if isinstance(res, SSHResult):
-        retcode = res.return_code
-        output = res.stdout
-    else:
-        retcode = res.returncode
-        output = res.stdout.decode()
 
-    if installed:
-        assert "Status: install ok installed" in output
+def mirror_file(path, headers=None):
+    """Returns the local path of the file at the given URL path of the mirrored
+    servers. The packages of the APT pools and the commercial downloads never
+    change and are only fetched once. The other files, like the APT indexes and
+    the key, are refreshed while the servers can be reached, and served from
+    MIRROR_POOL when they cannot be fetched.
+
+    The tests only run offline once MIRROR_POOL holds every file they need,
+    i.e. after a run with network access: the pool starts empty. The archives
+    of the distributions, used by apt-get for the dependencies, are not
+    mirrored and always need the network."""
+
+    for prefix, upstream in MIRROR_UPSTREAMS.items():
+        if path.startswith(prefix):
+            break
     else:
-        assert retcode != 0 or "Status: install ok installed" not in output
+        raise FileNotFoundError(path)
+
+    local = os.path.join(MIRROR_POOL, path.lstrip("/"))
+    immutable = "/pool/" in path or prefix == "/content/hosted/"
+    if immutable and os.path.isfile(local):
+        return local
+
+    request = urllib.request.Request(
+        upstream + path[len(prefix) :], headers=headers or {}
+    )
+    tmp = f"{local}.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+            with open(tmp, "wb") as f:
+                shutil.copyfileobj(response, f)
+            os.replace(tmp, local)
+    except OSError:
+        # Including the HTTP errors, the last fetched copy is served instead
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        if not os.path.isfile(local):
+            raise
+    return local
 
 
 class Handler(http.server.SimpleHTTPRequestHandler):
+    """Serves the scripts and, under the MIRROR_UPSTREAMS prefixes, the mirror."""
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=SCRIPT_SERVER_PATH, **kwargs)
 
+    def send_head(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if not path.startswith(tuple(MIRROR_UPSTREAMS)):
+            return super().send_head()
+
+        headers = {}
+        if "Authorization" in self.headers:
+            headers["Authorization"] = self.headers["Authorization"]
+        try:
+            local = mirror_file(path, headers)
+        except urllib.error.HTTPError as e:
+            self.log_error("cannot mirror %s: %s", path, e)
+            self.send_error(e.code)
+            return None
+        except OSError as e:
+            self.log_error("cannot mirror %s: %r", path, e)
+            self.send_error(http.HTTPStatus.BAD_GATEWAY)
+            return None
+
+        f = open(local, "rb")
+        size = os.fstat(f.fileno()).st_size
+        # Resumed downloads ask for the end of the file, from a given offset
+        start = 0
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= size:
+                f.close()
+                self.send_error(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                return None
+            f.seek(start)
+            self.send_response(http.HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(http.HTTPStatus.OK)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        return f
+
 
 @pytest.fixture(scope="session")
 def script_server():
-    thread = None
-    with socketserver.TCPServer(("0.0.0.0", SCRIPT_SERVER_PORT), Handler) as httpd:
-        httpd.allow_reuse_address = True
+    with http.server.ThreadingHTTPServer(
+        ("0.0.0.0", SCRIPT_SERVER_PORT), Handler
+    ) as httpd:
         thread = threading.Thread(target=httpd.serve_forever)
-        thread.daemon = False
         thread.start()
         yield
-    httpd.shutdown()
-    thread.join()
+        httpd.shutdown()
+        thread.join()
     print("cleaned up script server")
 
 
-@pytest.fixture(scope="function")
-def generic_container(request):
-    output = subprocess.check_output(
+GENERIC_IMAGE = f"mender-install-script-test:{REF_OS}-{REF_DISTRO}"
+GENERIC_IMAGE_BASE_LABEL = "io.mender.install-script-test.base-image"
+
+# Requirements of install-mender.sh, baked into GENERIC_IMAGE
+GENERIC_IMAGE_DOCKERFILE = f"""
+FROM {REF_OS}:{REF_DISTRO}
+RUN apt update && apt install -y curl
+"""
+
+
+def docker_image_id(image):
+    res = subprocess.run(
+        ["docker", "image", "inspect", "--format", "{{.Id}}", image],
+        capture_output=True,
+    )
+    return res.stdout.decode().strip() if res.returncode == 0 else None
+
+
+@pytest.fixture(scope="session")
+def generic_image():
+    """Builds GENERIC_IMAGE from the latest REF_OS:REF_DISTRO image, once per
+    session. The image is labeled with the ID of the base image and is only
+    rebuilt when the base image changes."""
+
+    subprocess.check_output(["docker", "pull", f"{REF_OS}:{REF_DISTRO}"])
+    base_id = docker_image_id(f"{REF_OS}:{REF_DISTRO}")
+    output = subprocess.run(
         [
             "docker",
-            "pull",
-            f"{REF_OS}:{REF_DISTRO}",
-        ]
+            "image",
+            "inspect",
+            "--format",
+            f'{{{{index .Config.Labels "{GENERIC_IMAGE_BASE_LABEL}"}}}}',
+            GENERIC_IMAGE,
+        ],
+        capture_output=True,
     )
+    if output.returncode != 0 or output.stdout.decode().strip() != base_id:
+        subprocess.run(
+            [
+                "docker",
+                "build",
+                "--network=host",
+                "--label",
+                f"{GENERIC_IMAGE_BASE_LABEL}={base_id}",
+                "--tag",
+                GENERIC_IMAGE,
+                "-",
+            ],
+            input=GENERIC_IMAGE_DOCKERFILE.encode(),
+            check=True,
+        )
+    return GENERIC_IMAGE
+
+
+@pytest.fixture(scope="function")
+def generic_container(request, generic_image):
+    return start_generic_container(request, generic_image)
+
+
+def start_generic_container(request, generic_image):
+    """Starts a container of generic_image, removed at the end of the test."""
     output = subprocess.check_output(
         [
             "docker",
@@ -96,15 +238,16 @@ def generic_container(request):
             "--network=host",
             "--rm",
             "-tid",
-            f"{REF_OS}:{REF_DISTRO}",
+            generic_image,
         ]
     )
 
     global docker_container_id
     docker_container_id = output.decode("utf-8").split("\n")[0]
+    container_id = docker_container_id
 
     def finalizer():
-        subprocess.check_output(["docker", "rm", "-f", docker_container_id])
+        subprocess.check_output(["docker", "rm", "-f", container_id])
 
     request.addfinalizer(finalizer)
 
@@ -128,55 +271,35 @@ def generic_container(request):
                 ["docker", "cp", source, f"{self.container_id}:{dest}"]
             )
 
-    c = GenericContainer(docker_container_id)
-
-    # Get install-mender.sh requirements
-    c.run("apt update")
-    c.run("apt install -y curl")
+        def get(self, source, dest):
+            subprocess.check_call(
+                ["docker", "cp", f"{self.container_id}:{source}", dest]
+            )
 
-    return c
+    return GenericContainer(container_id)
 
 
-def put_all_built_packages(container, dest):
+def put_apt_repo(container, paths, dest):
+    """Ships the given local packages and their Packages.gz index, built on the
+    host, to dest in one archive and enables the repository."""
+    archive = apt_repo_archive(paths)
     container.run(f"mkdir -p {dest}")
-    for package in glob.glob(f"{REF_PACKAGES}/*.deb"):
-        container.put(package, dest)
-
-
-def prepare_local_apt_repo(container, packages_path):
-    # Configure a local APT repo with dpkg-dev. See:
-    # https://askubuntu.com/questions/458748/is-it-possible-to-add-a-location-folder-on-my-hard-disk-to-sources-list
-    container.run("apt install -y dpkg-dev")
-    container.run(
-        f"cd {packages_path} && dpkg-scanpackages . /dev/null | gzip -9c > Packages.gz"
-    )
-    sources_list_file = (
-        f"/etc/apt/sources.list.d/{os.path.basename(packages_path)}.list"
-    )
-    container.run(
-        f"echo deb [trusted=yes] file:{packages_path} ./ > {sources_list_file}"
-    )
-    container.run("apt update")
+    container.put(archive, f"{dest}/apt-repo.tar")
+    container.run(f"cd {dest} && tar -xf apt-repo.tar && rm apt-repo.tar")
+    enable_local_apt_repo(container, dest)
 
 
 def local_apt_repo_from_built_packages(container):
-    put_all_built_packages(container, "/packages")
-    prepare_local_apt_repo(container, "/packages")
+    put_apt_repo(container, glob.glob(f"{REF_PACKAGES}/*.deb"), "/packages")
 
 
 def local_apt_repo_from_upstream_packages(container, pool_paths, dest):
-    container.run(f"mkdir {dest}")
-    for path in pool_paths:
-        url = f"https://downloads.mender.io/repos/{REF_OS}/pool/main/{path}"
-        container.run(f"cd {dest} && curl --remote-name {url}")
-
-    prepare_local_apt_repo(container, dest)
+    paths = [mirror_file(f"/repos/{REF_OS}/pool/main/{path}") for path in pool_paths]
+    put_apt_repo(container, paths, dest)
 
 
 def local_apt_repo_from_test_packages(container, pool_paths, dest):
-    container.run(f"mkdir {dest}")
-    for path in pool_paths:
-        url = f"https://downloads.mender.io/repos/{REF_OS}/pool/test-packages/{path}"
-        container.run(f"cd {dest} && curl --remote-name {url}")
-
-    prepare_local_apt_repo(container, dest)
+    paths = [
+        mirror_file(f"/repos/{REF_OS}/pool/test-packages/{path}") for path in pool_paths
+    ]
+    put_apt_repo(container, paths, dest)
@@ -13,11 +13,18 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import json
+import os
+import re
+
 import pytest
 
+import common
 from common import REF_OS, REF_DISTRO, SCRIPT_SERVER_ADDR, SCRIPT_SERVER_PORT
-from common import script_server, generic_container
-from common import check_installed, local_apt_repo_from_built_packages
+from common import SCRIPT_SERVER_PATH
+from common import MIRROR_ENV, script_server, generic_image, generic_container
+from common import start_generic_container
+from common import check_installed_many, local_apt_repo_from_built_packages
 
 
 @pytest.mark.usefixtures("script_server")
@@ -34,22 +41,26 @@ class TestInstallMenderScriptInstall:
             channel = "-c " + channel
 
         generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- {channel}"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- {channel}"
         )
 
-        for pkg in ["mender-client4", "mender-configure", "mender-connect"]:
-            check_installed(generic_container, pkg)
+        check_installed_many(
+            generic_container,
+            dict.fromkeys(
+                ["mender-client4", "mender-configure", "mender-connect"], True
+            ),
+        )
 
         # piggyback misc cmdline tests to save an extra container run
         # help
         res = generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- -h"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- -h"
         )
         assert "usage:" in res.stdout.decode()
 
         # invalid arg/module
         res = generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- unknown",
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- unknown",
             warn=True,
         )
         assert res.returncode == 1
@@ -62,7 +73,7 @@ class TestInstallMenderScriptInstall:
         """Pass mender setup args, should be propagated"""
 
         generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- -- --demo --device-type cool-device --hosted-mender --tenant-token my-secret-token"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- -- --demo --device-type cool-device --hosted-mender --tenant-token my-secret-token"
         )
 
         result = generic_container.run("cat /etc/mender/mender.conf")
@@ -74,6 +85,16 @@ class TestInstallMenderScriptInstall:
         result = generic_container.run("cat /etc/mender/mender-connect.conf")
         assert '"User": "nobody"' in result.stdout.decode()
 
+        # piggyback the APT repository checks: the key is only trusted for the
+        # Mender repository and neither gnupg nor jq were needed
+        result = generic_container.run("cat /etc/apt/sources.list.d/mender.list")
+        assert "signed-by=/etc/apt/keyrings/mender.asc" in result.stdout.decode()
+        res = generic_container.run(
+            "test -e /etc/apt/trusted.gpg.d/mender.asc", warn=True
+        )
+        assert res.returncode == 1
+        check_installed_many(generic_container, {"gnupg": False, "jq": False})
+
     def test_default_setup_addons(
         self,
         generic_container,
@@ -81,23 +102,73 @@ class TestInstallMenderScriptInstall:
         """Setup for add-ons (passing --demo)"""
 
         generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- --demo"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- --demo --json-summary /tmp/summary.json"
         )
 
         result = generic_container.run("cat /etc/mender/mender-connect.conf")
         assert '"User": "root"' in result.stdout.decode()
 
+        # piggyback the JSON summary checks
+        result = generic_container.run("cat /tmp/summary.json")
+        summary = json.loads(result.stdout.decode())
+        assert summary["exit_code"] == 0
+        assert summary["exit_reason"] == "success"
+        assert [phase["name"] for phase in summary["phases"]] == [
+            "check_dist_and_version",
+            "get_deps",
+            "add_repo",
+            "do_install_open",
+            "do_install_commercial",
+            "do_setup_mender_client",
+            "do_setup_other_components",
+        ]
+        assert None not in summary["components"].values()
+        assert "mender-configure-demo" in summary["components"]
+        assert summary["bytes_downloaded"] > 0
+
+    def test_json_summary_failure(
+        self,
+        generic_container,
+    ):
+        """The JSON summary of a failed installation names the failed phase"""
+
+        # Nothing listens on port 1, the commercial download fails
+        res = generic_container.run(
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | "
+            f"{MIRROR_ENV} MENDER_COMMERCIAL_DOWNLOAD_URL=http://localhost:1/ "
+            "bash -s -- --jwt-token test-token mender-monitor --json-summary /tmp/summary.json",
+            warn=True,
+        )
+        assert res.returncode != 0
+
+        result = generic_container.run("cat /tmp/summary.json")
+        summary = json.loads(result.stdout.decode())
+        assert summary["exit_code"] == res.returncode
+        assert summary["exit_reason"] == "failed in do_install_commercial"
+        assert [phase["name"] for phase in summary["phases"]] == [
+            "check_dist_and_version",
+            "get_deps",
+            "add_repo",
+            "do_install_open",
+        ]
+        assert summary["components"] == {"mender-monitor": None}
+
     def test_client(
         self,
         generic_container,
     ):
         generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- mender-client"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- mender-client"
         )
 
-        check_installed(generic_container, "mender-client")
-        check_installed(generic_container, "mender-connect", installed=False)
-        check_installed(generic_container, "mender-configure", installed=False)
+        check_installed_many(
+            generic_container,
+            {
+                "mender-client": True,
+                "mender-connect": False,
+                "mender-configure": False,
+            },
+        )
 
         res = generic_container.run("dpkg --status mender-connect", warn=True)
         assert res.returncode == 1
@@ -107,25 +178,207 @@ class TestInstallMenderScriptInstall:
         generic_container,
     ):
         generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- mender-connect"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- mender-connect"
         )
 
-        check_installed(generic_container, "mender-auth")
-        check_installed(generic_container, "mender-connect")
-        check_installed(generic_container, "mender-configure", installed=False)
+        check_installed_many(
+            generic_container,
+            {
+                "mender-auth": True,
+                "mender-connect": True,
+                "mender-configure": False,
+            },
+        )
 
     def test_configure(
         self,
         generic_container,
     ):
         generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- mender-configure"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- mender-configure"
+        )
+
+        check_installed_many(
+            generic_container,
+            {
+                "mender-auth": True,
+                "mender-update": True,
+                "mender-connect": False,
+                "mender-configure": True,
+            },
+        )
+
+
+@pytest.mark.usefixtures("script_server")
+class TestInstallMenderScriptBundle:
+    def test_create_and_install_bundle(
+        self,
+        request,
+        generic_image,
+        generic_container,
+        tmp_path,
+    ):
+        generic_container.run(
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh -o /tmp/install-mender.sh"
+        )
+        # A dependency of mender-auth already installed where the bundle is
+        # created must still be in the bundle
+        generic_container.run("apt-get update && apt-get install -y dbus")
+        generic_container.run(
+            f"{MIRROR_ENV} bash /tmp/install-mender.sh --demo --create-bundle /tmp/mender-bundle.tar"
+        )
+
+        # Nothing is installed when creating the bundle
+        check_installed_many(
+            generic_container,
+            {"mender-client4": False, "mender-connect": False},
+        )
+
+        # The bundle is installed on a fresh device. Without the package
+        # lists, APT can only install from the bundle.
+        generic_container.get("/tmp/install-mender.sh", str(tmp_path))
+        generic_container.get("/tmp/mender-bundle.tar", str(tmp_path))
+        device = start_generic_container(request, generic_image)
+        device.put(str(tmp_path / "install-mender.sh"), "/tmp/install-mender.sh")
+        device.put(str(tmp_path / "mender-bundle.tar"), "/tmp/mender-bundle.tar")
+        check_installed_many(device, {"dbus": False})
+        device.run("rm -rf /var/lib/apt/lists/*")
+        device.run(
+            f"{MIRROR_ENV} bash /tmp/install-mender.sh --bundle /tmp/mender-bundle.tar"
+        )
+
+        check_installed_many(
+            device,
+            dict.fromkeys(
+                [
+                    "mender-client4",
+                    "mender-configure",
+                    "mender-connect",
+                    "mender-configure-demo",
+                    "mender-configure-timezone",
+                ],
+                True,
+            ),
+        )
+        res = device.run("apt-mark showmanual")
+        assert "mender-update" not in res.stdout.decode().split()
+        assert "dbus" not in res.stdout.decode().split()
+
+        result = device.run("cat /etc/mender/mender-connect.conf")
+        assert '"User": "root"' in result.stdout.decode()
+
+
+def serve_mender_monitor_stand_in(container, pool, depends=None, checksum=True):
+    """Builds a mender-monitor stand-in of a few hundred kilobytes in the
+    container, at /tmp/mender-monitor.deb, and puts it in the pool of the
+    mirror, at the URL path of the latest version, with its checksum unless
+    checksum is False. depends is its Depends field, if any. Returns that path
+    under /content/hosted/."""
+
+    with open(os.path.join(SCRIPT_SERVER_PATH, "install-mender.sh")) as f:
+        version = re.search(
+            r'^MENDER_MONITOR_LATEST_VERSION="(.*)"$', f.read(), re.MULTILINE
+        ).group(1)
+    deb_version = f"{version}-1+{REF_OS}+{REF_DISTRO}"
+    url_path = f"mender-monitor/debian/{version}/mender-monitor_{deb_version}_all.deb"
+
+    container.run(
+        "mkdir -p /tmp/stand-in/DEBIAN /tmp/stand-in/usr/share/mender-monitor && "
+        "head -c 300000 /dev/urandom > /tmp/stand-in/usr/share/mender-monitor/data && "
+        f"printf 'Package: mender-monitor\\nVersion: {deb_version}\\n"
+        "Architecture: all\\nMaintainer: The Mender Team <mender@northern.tech>\\n"
+        + (f"Depends: {depends}\\n" if depends else "")
+        + "Description: mender-monitor stand-in\\n' > /tmp/stand-in/DEBIAN/control && "
+        "dpkg-deb -b /tmp/stand-in /tmp/mender-monitor.deb"
+    )
+    local = os.path.join(pool, "content", "hosted", url_path)
+    os.makedirs(os.path.dirname(local))
+    container.get("/tmp/mender-monitor.deb", local)
+    if checksum:
+        res = container.run("sha256sum /tmp/mender-monitor.deb")
+        with open(f"{local}.sha256", "w") as f:
+            f.write(res.stdout.decode())
+    return url_path
+
+
+@pytest.mark.usefixtures("script_server")
+class TestInstallMenderScriptCommercialDownloads:
+    def test_resume_and_cache(self, generic_container, monkeypatch, tmp_path):
+        """A partial download is resumed, and a verified package is kept in the
+        cache and never downloaded again."""
+
+        # The stand-in must not end up in the persistent pool
+        pool = str(tmp_path / "pool")
+        monkeypatch.setattr(common, "MIRROR_POOL", pool)
+        url_path = serve_mender_monitor_stand_in(generic_container, pool)
+        size = os.path.getsize(os.path.join(pool, "content", "hosted", url_path))
+
+        # The partial download left by an interrupted run
+        cached = f"/var/cache/mender-install/{url_path}"
+        generic_container.run(
+            f"mkdir -p $(dirname {cached}) && "
+            f"head -c {size // 2} /tmp/mender-monitor.deb > {cached}.part"
+        )
+
+        install = (
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | "
+            f"{MIRROR_ENV} bash -s -- --jwt-token test-token mender-monitor --json-summary"
+        )
+        generic_container.run(f"{install} /tmp/first.json")
+        check_installed_many(generic_container, {"mender-monitor": True})
+        result = generic_container.run("cat /tmp/first.json")
+        assert (
+            json.loads(result.stdout.decode())["bytes_downloaded"] == size - size // 2
+        )
+        generic_container.run(f"cmp {cached} /tmp/mender-monitor.deb")
+
+        generic_container.run(f"{install} /tmp/second.json")
+        result = generic_container.run("cat /tmp/second.json")
+        assert json.loads(result.stdout.decode())["bytes_downloaded"] == 0
+
+    def test_no_published_checksum(self, generic_container, monkeypatch, tmp_path):
+        """Without a published checksum, neither a partial download nor a
+        cached package is trusted, the package is downloaded in full."""
+
+        pool = str(tmp_path / "pool")
+        monkeypatch.setattr(common, "MIRROR_POOL", pool)
+        url_path = serve_mender_monitor_stand_in(
+            generic_container, pool, checksum=False
+        )
+        size = os.path.getsize(os.path.join(pool, "content", "hosted", url_path))
+
+        cached = f"/var/cache/mender-install/{url_path}"
+        generic_container.run(
+            f"mkdir -p $(dirname {cached}) && "
+            f"head -c {size // 2} /tmp/mender-monitor.deb > {cached}.part"
         )
 
-        check_installed(generic_container, "mender-auth")
-        check_installed(generic_container, "mender-update")
-        check_installed(generic_container, "mender-connect", installed=False)
-        check_installed(generic_container, "mender-configure")
+        install = (
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | "
+            f"{MIRROR_ENV} bash -s -- --jwt-token test-token mender-monitor --json-summary"
+        )
+        for run in ["first", "second"]:
+            result = generic_container.run(f"{install} /tmp/{run}.json")
+            assert "No checksum published" in result.stderr.decode()
+            result = generic_container.run(f"cat /tmp/{run}.json")
+            assert json.loads(result.stdout.decode())["bytes_downloaded"] == size
+        check_installed_many(generic_container, {"mender-monitor": True})
+
+    def test_missing_dependencies(self, generic_container, monkeypatch, tmp_path):
+        """The dependencies of the commercial components are installed even
+        when no open source component updated the package lists."""
+
+        pool = str(tmp_path / "pool")
+        monkeypatch.setattr(common, "MIRROR_POOL", pool)
+        serve_mender_monitor_stand_in(generic_container, pool, depends="jq")
+        # A device that never ran apt-get update
+        generic_container.run("rm -rf /var/lib/apt/lists/*")
+
+        generic_container.run(
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | "
+            f"{MIRROR_ENV} bash -s -- --jwt-token test-token mender-monitor"
+        )
+        check_installed_many(generic_container, {"mender-monitor": True, "jq": True})
 
 
 @pytest.mark.usefixtures("script_server")
@@ -136,7 +389,7 @@ class TestInstallMenderScriptUpgrade:
     ):
         # Install default stable software
         generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s"
         )
 
         # Now upgrade to freshly built packages
@@ -144,16 +397,21 @@ class TestInstallMenderScriptUpgrade:
         generic_container.run("apt --assume-yes upgrade")
 
         # Legacy "mender-client" should never be installed
-        check_installed(generic_container, "mender-client", installed=False)
-        # Default packages
-        check_installed(generic_container, "mender-client4")
-        check_installed(generic_container, "mender-update")
-        check_installed(generic_container, "mender-auth")
-        check_installed(generic_container, "mender-flash")
-        check_installed(generic_container, "mender-setup")
-        check_installed(generic_container, "mender-snapshot")
-        check_installed(generic_container, "mender-connect")
-        check_installed(generic_container, "mender-configure")
+        check_installed_many(
+            generic_container,
+            {
+                "mender-client": False,
+                # Default packages
+                "mender-client4": True,
+                "mender-update": True,
+                "mender-auth": True,
+                "mender-flash": True,
+                "mender-setup": True,
+                "mender-snapshot": True,
+                "mender-connect": True,
+                "mender-configure": True,
+            },
+        )
 
     def test_upgrade_mender_meta_package_only_client(
         self,
@@ -161,7 +419,7 @@ class TestInstallMenderScriptUpgrade:
     ):
         # Install only the meta-package
         generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- mender-client4"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- mender-client4"
         )
 
         # Now upgrade to freshly built packages
@@ -169,17 +427,22 @@ class TestInstallMenderScriptUpgrade:
         generic_container.run("apt --assume-yes upgrade")
 
         # Legacy "mender-client" should never be installed
-        check_installed(generic_container, "mender-client", installed=False)
-        # Packages bundled in the meta package
-        check_installed(generic_container, "mender-client4")
-        check_installed(generic_container, "mender-update")
-        check_installed(generic_container, "mender-auth")
-        check_installed(generic_container, "mender-flash")
-        check_installed(generic_container, "mender-setup")
-        check_installed(generic_container, "mender-snapshot")
-        # No addons
-        check_installed(generic_container, "mender-connect", installed=False)
-        check_installed(generic_container, "mender-configure", installed=False)
+        check_installed_many(
+            generic_container,
+            {
+                "mender-client": False,
+                # Packages bundled in the meta package
+                "mender-client4": True,
+                "mender-update": True,
+                "mender-auth": True,
+                "mender-flash": True,
+                "mender-setup": True,
+                "mender-snapshot": True,
+                # No addons
+                "mender-connect": False,
+                "mender-configure": False,
+            },
+        )
 
     def test_upgrade_mender_explicit_auth_update(
         self,
@@ -187,7 +450,7 @@ class TestInstallMenderScriptUpgrade:
     ):
         # Install the actual core packages
         generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- mender-auth mender-update"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- mender-auth mender-update"
         )
 
         # Now upgrade to freshly built packages
@@ -195,15 +458,20 @@ class TestInstallMenderScriptUpgrade:
         generic_container.run("apt --assume-yes upgrade")
 
         # Legacy "mender-client" should never be installed
-        check_installed(generic_container, "mender-client", installed=False)
-        # The meta-package neither!
-        check_installed(generic_container, "mender-client4", installed=False)
-        check_installed(generic_container, "mender-snapshot", installed=False)
-        # Only the actual core packages
-        check_installed(generic_container, "mender-update")
-        check_installed(generic_container, "mender-auth")
-        check_installed(generic_container, "mender-setup")
-        check_installed(generic_container, "mender-flash")
-        # No addons
-        check_installed(generic_container, "mender-connect", installed=False)
-        check_installed(generic_container, "mender-configure", installed=False)
+        check_installed_many(
+            generic_container,
+            {
+                "mender-client": False,
+                # The meta-package neither!
+                "mender-client4": False,
+                "mender-snapshot": False,
+                # Only the actual core packages
+                "mender-update": True,
+                "mender-auth": True,
+                "mender-setup": True,
+                "mender-flash": True,
+                # No addons
+                "mender-connect": False,
+                "mender-configure": False,
+            },
+        )
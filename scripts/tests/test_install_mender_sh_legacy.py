@@ -16,9 +16,9 @@
 import pytest
 
 from common import SCRIPT_SERVER_ADDR, SCRIPT_SERVER_PORT
-from common import script_server, generic_container
+from common import MIRROR_ENV, script_server, generic_image, generic_container
 from common import (
-    check_installed,
+    check_installed_many,
     local_apt_repo_from_upstream_packages,
     local_apt_repo_from_test_packages,
 )
@@ -44,9 +44,14 @@ class TestUpgradeMenderV4:
             "DEBIAN_FRONTEND=noninteractive apt install --assume-yes mender-client mender-connect mender-configure"
         )
 
-        check_installed(generic_container, "mender-client")
-        check_installed(generic_container, "mender-connect")
-        check_installed(generic_container, "mender-configure")
+        check_installed_many(
+            generic_container,
+            {
+                "mender-client": True,
+                "mender-connect": True,
+                "mender-configure": True,
+            },
+        )
 
         # Upgrade to mender-client 4.0.0
         local_apt_repo_from_test_packages(
@@ -65,29 +70,39 @@ class TestUpgradeMenderV4:
         )
         # Note the use of apt instead of apt-get - the latter wouldn't install the new packages
         generic_container.run("apt --assume-yes upgrade")
-        check_installed(generic_container, "mender-client")
-        check_installed(generic_container, "mender-update")
-        check_installed(generic_container, "mender-auth")
-        check_installed(generic_container, "mender-flash")
-        check_installed(generic_container, "mender-setup")
-        check_installed(generic_container, "mender-snapshot")
-        check_installed(generic_container, "mender-connect")
-        check_installed(generic_container, "mender-configure")
+        check_installed_many(
+            generic_container,
+            {
+                "mender-client": True,
+                "mender-update": True,
+                "mender-auth": True,
+                "mender-flash": True,
+                "mender-setup": True,
+                "mender-snapshot": True,
+                "mender-connect": True,
+                "mender-configure": True,
+            },
+        )
 
         # Install upstream repo and upgrade to the last Debian 11 packages
         # The script requires at least one package; use mender-flash because it has no dependencies
         generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- mender-flash"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- mender-flash"
         )
         generic_container.run("apt --assume-yes upgrade")
-        check_installed(generic_container, "mender-client")
-        check_installed(generic_container, "mender-update")
-        check_installed(generic_container, "mender-auth")
-        check_installed(generic_container, "mender-flash")
-        check_installed(generic_container, "mender-setup")
-        check_installed(generic_container, "mender-snapshot")
-        check_installed(generic_container, "mender-connect")
-        check_installed(generic_container, "mender-configure")
+        check_installed_many(
+            generic_container,
+            {
+                "mender-client": True,
+                "mender-update": True,
+                "mender-auth": True,
+                "mender-flash": True,
+                "mender-setup": True,
+                "mender-snapshot": True,
+                "mender-connect": True,
+                "mender-configure": True,
+            },
+        )
 
     def test_upgrade_from_v3_to_last_debian_11(
         self,
@@ -106,19 +121,29 @@ class TestUpgradeMenderV4:
         generic_container.run(
             "DEBIAN_FRONTEND=noninteractive apt install --assume-yes mender-client mender-connect mender-configure"
         )
-        check_installed(generic_container, "mender-client")
-        check_installed(generic_container, "mender-connect")
-        check_installed(generic_container, "mender-configure")
+        check_installed_many(
+            generic_container,
+            {
+                "mender-client": True,
+                "mender-connect": True,
+                "mender-configure": True,
+            },
+        )
 
         # Install upstream repo and upgrade to the last Debian 11 packages
         # The script requires at least one package; use mender-flash because it has no dependencies
         generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- mender-flash"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- mender-flash"
         )
         generic_container.run("apt --assume-yes upgrade")
-        check_installed(generic_container, "mender-client")
-        check_installed(generic_container, "mender-connect")
-        check_installed(generic_container, "mender-configure")
+        check_installed_many(
+            generic_container,
+            {
+                "mender-client": True,
+                "mender-connect": True,
+                "mender-configure": True,
+            },
+        )
 
     def test_upgrade_from_v4_to_last_debian_11(
         self,
@@ -146,9 +171,14 @@ class TestUpgradeMenderV4:
         # Install upstream repo and upgrade to the last Debian 11 packages
         # The script requires at least one package; use mender-flash because it has no dependencies
         generic_container.run(
-            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | bash -s -- mender-flash"
+            f"curl http://{SCRIPT_SERVER_ADDR}:{SCRIPT_SERVER_PORT}/install-mender.sh | {MIRROR_ENV} bash -s -- mender-flash"
         )
         generic_container.run("apt --assume-yes upgrade")
-        check_installed(generic_container, "mender-client")
-        check_installed(generic_container, "mender-connect")
-        check_installed(generic_container, "mender-configure")
+        check_installed_many(
+            generic_container,
+            {
+                "mender-client": True,
+                "mender-connect": True,
+                "mender-configure": True,
+            },
+        )
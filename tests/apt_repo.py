@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Local APT repositories for the tests.
+
+The Packages index is built on the host, once per session for a given set of
+packages, so the test containers neither need dpkg-dev nor have to scan the
+packages themselves.
+"""
+
+import atexit
+import gzip
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+
+from tests.deb_contents import control_file
+
+_work_dir = None
+
+# Packages.gz and repository archives, keyed on the names, sizes and mtimes of
+# the packages
+_indexes = {}
+_archives = {}
+
+
+def _session_dir():
+    global _work_dir
+    if _work_dir is None:
+        _work_dir = tempfile.mkdtemp(prefix="mender-apt-repo-")
+        atexit.register(shutil.rmtree, _work_dir, True)
+    return _work_dir
+
+
+def _signature(paths):
+    signature = []
+    for path in sorted(paths):
+        st = os.stat(path)
+        signature.append((os.path.basename(path), st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+
+def packages_index(paths):
+    """Returns the local path of a Packages.gz index for the given packages, as
+    dpkg-scanpackages would generate it for a flat repository holding them."""
+
+    signature = _signature(paths)
+    if signature not in _indexes:
+        entries = []
+        for path in sorted(paths, key=os.path.basename):
+            with open(path, "rb") as f:
+                data = f.read()
+            entries.append(
+                control_file(path).rstrip("\n")
+                + f"\nFilename: ./{os.path.basename(path)}"
+                + f"\nSize: {len(data)}"
+                + f"\nMD5sum: {hashlib.md5(data).hexdigest()}"
+                + f"\nSHA1: {hashlib.sha1(data).hexdigest()}"
+                + f"\nSHA256: {hashlib.sha256(data).hexdigest()}\n"
+            )
+        index_dir = tempfile.mkdtemp(dir=_session_dir())
+        index = os.path.join(index_dir, "Packages.gz")
+        with open(index, "wb") as f:
+            f.write(gzip.compress("\n".join(entries).encode(), mtime=0))
+        _indexes[signature] = index
+    return _indexes[signature]
+
+
+def apt_repo_archive(paths):
+    """Returns the local path of a tar archive with the given packages and their
+    Packages.gz index, to be extracted in the repository directory."""
+
+    signature = _signature(paths)
+    if signature not in _archives:
+        archive = os.path.join(tempfile.mkdtemp(dir=_session_dir()), "apt-repo.tar")
+        # The packages are already compressed
+        with tarfile.open(archive, "w") as tar:
+            for path in paths:
+                tar.add(path, arcname=os.path.basename(path))
+            tar.add(packages_index(paths), arcname="Packages.gz")
+        _archives[signature] = archive
+    return _archives[signature]
+
+
+def enable_local_apt_repo(conn, packages_path):
+    """Adds the repository in packages_path, which must hold the packages and
+    their Packages.gz index, to the APT sources of the device given by conn."""
+
+    sources_list_file = (
+        f"/etc/apt/sources.list.d/{os.path.basename(packages_path)}.list"
+    )
+    conn.run(f"echo deb [trusted=yes] file:{packages_path} ./ > {sources_list_file}")
+    conn.run("apt update")
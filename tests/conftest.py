@@ -15,32 +15,53 @@
 
 import packaging.version
 
+import functools
 import os
 import pytest
 
 from mender_test_containers.container_props import *
 from mender_test_containers.conftest import *
 
+from deb_contents import DebContents, DebPackage
+from device_container import DEVICE_IMAGE, build_device_image, start_device_container
+from helpers import get_distro_family, get_distro_version
+
+pytest_plugins = ["latency_profile"]
+
 TEST_CONTAINER_LIST = [MenderTestNoContainer]
 
+# Packages installed on the device right after setup_mender_configured
+device_snapshot_key = pytest.StashKey[dict]()
+
+# Fixtures giving access to the test container
+DEVICE_FIXTURES = [
+    "setup_test_container",
+    "setup_tester_ssh_connection",
+    "setup_mender_configured",
+    "mender_configured_device",
+]
+
 
 @pytest.fixture(scope="session", params=TEST_CONTAINER_LIST)
 def setup_test_container_props(request):
     return request.param
 
 
-def get_distro_family():
-    # Inherit this from the CI calling the tests
-    distro_family = os.getenv("OS_FAMILY", "")
-    assert distro_family != ""
-    return distro_family
-
+if DEVICE_IMAGE:
+    # Every pytest-xdist worker tests a container of its own, see
+    # device_container.py
+    @pytest.fixture(scope="session")
+    def setup_test_container(request, tmp_path_factory):
+        build_device_image()
+        device = start_device_container(str(tmp_path_factory.mktemp("device")))
+        if device is None:
+            raise TestContainerDidNotboot()
+        request.addfinalizer(device.stop)
+        return device
 
-def get_distro_version():
-    # Inherit this from the CI calling the tests
-    distro_version = os.getenv("OS_VERSION_NAME", "")
-    assert distro_version != ""
-    return distro_version
+    @pytest.fixture(scope="session")
+    def setup_tester_ssh_connection(setup_test_container):
+        return setup_test_container.conn
 
 
 def pytest_addoption(parser):
@@ -135,6 +156,48 @@ def did_not_boot(err, *args):
     return issubclass(err[0], TestContainerDidNotboot)
 
 
+# Version markers and the option holding the version of the component
+MIN_VERSION_MARKERS = {
+    "min_mender_client_version": "--mender-client-version",
+    "min_mender_connect_version": "--mender-connect-version",
+    "min_mender_configure_version": "--mender-configure-version",
+    "min_setup_version": "--mender-setup-version",
+    "min_snapshot_version": "--mender-snapshot-version",
+    "min_flash_version": "--mender-flash-version",
+    "min_mender_monitor_version": "--mender-monitor-version",
+    "min_mender_gateway_version": "--mender-gateway-version",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_version(version):
+    try:
+        return packaging.version.Version(version)
+    except packaging.version.InvalidVersion:
+        # Indicates that 'version' is likely a string (master).
+        return None
+
+
+def is_eligible(config, item):
+    for marker in item.iter_markers(name="requires_option"):
+        if not config.getoption(marker.args[0]):
+            return False
+
+    for marker_name, opt in MIN_VERSION_MARKERS.items():
+        version_mark = item.get_closest_marker(marker_name)
+        if version_mark is None:
+            continue
+        version = config.getoption(opt)
+        if version is None:
+            # Package was not built/specified, no version constraint to enforce.
+            continue
+        required = parse_version(version_mark.args[0])
+        current = parse_version(version)
+        if required is not None and current is not None and required > current:
+            return False
+    return True
+
+
 def pytest_collection_modifyitems(config, items):
     if not config.getoption("--commercial-tests"):
         skip_commercial = pytest.mark.skip(
@@ -144,18 +207,31 @@ def pytest_collection_modifyitems(config, items):
             if "commercial" in item.keywords:
                 item.add_marker(skip_commercial)
 
-    # Skip tests whose required CLI option (e.g. --mender-flash-deb-version)
-    # was not provided. Tests advertise their requirements via the
-    # `requires_option` marker, allowing per-package builds to skip
-    # corresponding tests automatically.
+    # Skip the tests whose required CLI option (e.g.
+    # --mender-flash-deb-version) was not provided, or that require a newer
+    # version of a component than the one under test. Tests advertise their
+    # requirements via the `requires_option` and `min_*_version` markers, which
+    # are evaluated once here. The skip marker is applied before any fixture,
+    # like the test container, is set up for the test. The tests are skipped
+    # rather than deselected, as a job whose tests were all deselected would
+    # fail with the "no tests collected" exit status.
+    skip_ineligible = pytest.mark.skip(
+        reason="a required package was not built or is too old"
+    )
+    for item in items:
+        if not is_eligible(config, item):
+            item.add_marker(skip_ineligible)
+
+    # With pytest-xdist (--dist loadgroup), each worker tests its own device
+    # container. The tests using it are grouped per module, so that tests
+    # relying on the state left by earlier ones in the same module, like the
+    # orchestrator classes, keep running in order on the same worker. Tests
+    # that do not need a device are distributed freely.
     for item in items:
-        for marker in item.iter_markers(name="requires_option"):
-            opt = marker.args[0]
-            if not config.getoption(opt):
-                item.add_marker(
-                    pytest.mark.skip(reason=f"{opt} not provided (package not built)")
-                )
-                break
+        if item.get_closest_marker("xdist_group") is not None:
+            continue
+        if any(name in item.fixturenames for name in DEVICE_FIXTURES):
+            item.add_marker(pytest.mark.xdist_group(item.module.__name__))
 
     flaky_marker = pytest.mark.flaky(max_runs=3, rerun_filter=did_not_boot)
     for item in items:
@@ -193,96 +269,111 @@ def mender_dist_packages_versions(request):
     }
 
 
-# Required for mender_test_containers/conftest.py::setup_mender_configured,
-# which is only used on addons packages tests.
 @pytest.fixture(scope="session")
-def mender_deb_version(request):
-    return "5.0.5"
+def deb_contents():
+    """Returns a function opening the given built packages as one DebContents,
+    for checks that do not need a booted test container. Each package is only
+    read once per session."""
+    packages = {}
 
+    def open_packages(*paths):
+        for path in paths:
+            if path not in packages:
+                packages[path] = DebPackage(path)
+        return DebContents([packages[path] for path in paths])
 
-def min_version_impl(request, marker, min_version):
-    if min_version is None:
-        # Package was not built/specified, no version constraint to enforce.
-        return
-    version_mark = request.node.get_closest_marker(marker)
-    if version_mark is not None:
-        try:
-            if packaging.version.Version(
-                version_mark.args[0]
-            ) > packaging.version.Version(min_version):
-                pytest.skip("Test requires %s %s" % (marker, version_mark.args[0]))
-        except packaging.version.InvalidVersion:
-            # Indicates that 'version' is likely a string (master).
-            pass
-
-
-@pytest.fixture(autouse=True)
-def min_mender_client_version(request):
-    min_version_impl(
-        request,
-        "min_mender_client_version",
-        request.config.getoption("--mender-client-version"),
-    )
+    return open_packages
 
 
-@pytest.fixture(autouse=True)
-def min_mender_connect_version(request):
-    min_version_impl(
-        request,
-        "min_mender_connect_version",
-        request.config.getoption("--mender-connect-version"),
-    )
+DEVICE_SNAPSHOT = "/var/lib/mender-test-snapshot.tar"
+DEVICE_SNAPSHOT_PATHS = ["/etc/mender", "/var/lib/mender"]
+# Copies of the packages uploaded to the home directory, which are in no apt
+# source
+DEVICE_SNAPSHOT_DEBS = "/var/lib/mender-test-snapshot-debs"
 
 
-@pytest.fixture(autouse=True)
-def min_mender_configure_version(request):
-    min_version_impl(
-        request,
-        "min_mender_configure_version",
-        request.config.getoption("--mender-configure-version"),
+def installed_packages(conn):
+    """Returns the name and version of every package installed on the device
+    given by conn."""
+    res = conn.run(
+        "dpkg-query --show --showformat='${Package}\\t${Status}\\t${Version}\\n'"
     )
-
-
-@pytest.fixture(autouse=True)
-def min_setup_version(request):
-    min_version_impl(
-        request,
-        "min_setup_version",
-        request.config.getoption("--mender-setup-version"),
-    )
-
-
-@pytest.fixture(autouse=True)
-def min_snapshot_version(request):
-    min_version_impl(
-        request,
-        "min_snapshot_version",
-        request.config.getoption("--mender-snapshot-version"),
+    packages = {}
+    for line in res.stdout.splitlines():
+        name, status, version = line.split("\t")
+        if status == "install ok installed":
+            packages[name] = version
+    return packages
+
+
+def snapshot_debs(conn):
+    """Returns the kept copies of the uploaded packages on the device given by
+    conn, keyed on name=version."""
+    res = conn.run(
+        f"for deb in {DEVICE_SNAPSHOT_DEBS}/*.deb; do "
+        + '[ -f "$deb" ] || continue; '
+        + 'echo "$(dpkg-deb --show --showformat=\'${Package}=${Version}\' "$deb") $deb"; '
+        + "done"
     )
+    debs = {}
+    for line in res.stdout.splitlines():
+        package, path = line.split(" ", 1)
+        debs[package] = path
+    return debs
+
+
+@pytest.fixture(scope="class")
+def mender_configured_device(request, setup_tester_ssh_connection):
+    """Provides the device as set up by setup_mender_configured to each test
+    class. The installed packages and the Mender configuration and state are
+    recorded on first use, and restored for each following class: packages
+    installed since are purged and the removed or changed ones are installed
+    again at the recorded version, from the packages uploaded by then or from
+    the apt sources, so the classes do not depend on the order in which they
+    run."""
+
+    conn = setup_tester_ssh_connection
+    snapshot = request.config.stash.get(device_snapshot_key, None)
+    if snapshot is None:
+        request.getfixturevalue("setup_mender_configured")
+        conn.run(
+            f"sudo tar -cpf {DEVICE_SNAPSHOT} --ignore-failed-read "
+            + " ".join(DEVICE_SNAPSHOT_PATHS)
+            + f" && sudo mkdir -p {DEVICE_SNAPSHOT_DEBS}"
+            + f" && (sudo cp ~/*.deb {DEVICE_SNAPSHOT_DEBS} 2>/dev/null || true)"
+        )
+        request.config.stash[device_snapshot_key] = installed_packages(conn)
+        return
 
-
-@pytest.fixture(autouse=True)
-def min_flash_version(request):
-    min_version_impl(
-        request,
-        "min_flash_version",
-        request.config.getoption("--mender-flash-version"),
-    )
-
-
-@pytest.fixture(autouse=True)
-def min_mender_monitor_version(request):
-    min_version_impl(
-        request,
-        "min_mender_monitor_version",
-        request.config.getoption("--mender-monitor-version"),
+    current = installed_packages(conn)
+    extra = [name for name in current if name not in snapshot]
+    if extra:
+        conn.run("sudo apt-get purge --assume-yes " + " ".join(extra))
+    changed = [
+        f"{name}={version}"
+        for name, version in snapshot.items()
+        if current.get(name) != version
+    ]
+    if changed:
+        debs = snapshot_debs(conn)
+        uploaded = [debs[package] for package in changed if package in debs]
+        if uploaded:
+            conn.run("sudo dpkg --install " + " ".join(uploaded))
+        from_apt = [package for package in changed if package not in debs]
+        if from_apt:
+            conn.run(
+                "sudo apt-get install --assume-yes --allow-downgrades "
+                + " ".join(from_apt)
+            )
+    conn.run(
+        "sudo rm -rf "
+        + " ".join(DEVICE_SNAPSHOT_PATHS)
+        + f" && sudo tar -xpf {DEVICE_SNAPSHOT} -C /"
     )
 
 
-@pytest.fixture(autouse=True)
-def min_mender_gateway_version(request):
-    min_version_impl(
-        request,
-        "min_mender_gateway_version",
-        request.config.getoption("--mender-gateway-version"),
-    )
+# Required for mender_test_containers/conftest.py::setup_mender_configured,
+# which is only used on addons packages tests.
+@pytest.fixture(scope="session")
+def mender_deb_version(request):
+    return "5.0.5"
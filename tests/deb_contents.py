@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Static inspection of built .deb packages.
+
+The packages are read in-process (ar archive with the control and data
+tarballs), so that checks on the installed paths, modes, symlinks, conffiles
+and maintainer scripts do not need a booted test container.
+"""
+
+import io
+import os
+import stat
+import tarfile
+
+import zstandard
+
+MAINTAINER_SCRIPTS = ["preinst", "postinst", "prerm", "postrm", "config", "triggers"]
+
+
+def _ar_members(path):
+    """Yields the name and contents of every member of the ar archive."""
+    with open(path, "rb") as f:
+        if f.read(8) != b"!<arch>\n":
+            raise ValueError(f"{path} is not a Debian package")
+        while True:
+            header = f.read(60)
+            if len(header) < 60:
+                return
+            name = header[:16].decode().strip().rstrip("/")
+            size = int(header[48:58].decode().strip())
+            data = f.read(size)
+            # Members are aligned to even offsets
+            if size % 2:
+                f.read(1)
+            yield name, data
+
+
+def _open_tarball(name, data):
+    if name.endswith(".zst"):
+        # Not supported by tarfile, used by Ubuntu
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        return tarfile.open(fileobj=io.BytesIO(data), mode="r:")
+    return tarfile.open(fileobj=io.BytesIO(data), mode="r:*")
+
+
+def _normalize(name):
+    return os.path.normpath(os.path.join("/", name))
+
+
+def control_file(path):
+    """Returns the text of the control file of the package, without reading the
+    data tarball."""
+    for name, data in _ar_members(path):
+        if name.startswith("control.tar"):
+            tar = _open_tarball(name, data)
+            for member in tar.getmembers():
+                if member.isfile() and os.path.basename(member.name) == "control":
+                    return tar.extractfile(member).read().decode()
+    raise ValueError(f"{path} has no control file")
+
+
+class DebEntry:
+    """A path shipped by a package."""
+
+    def __init__(self, package, member):
+        self.package = package
+        self.member = member
+        self.path = _normalize(member.name)
+        self.mode = member.mode
+        self.linkname = member.linkname if member.issym() else None
+
+    def is_file(self):
+        return self.member.isfile()
+
+    def is_dir(self):
+        return self.member.isdir()
+
+    def is_symlink(self):
+        return self.member.issym()
+
+    def is_executable(self):
+        return bool(self.mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH))
+
+
+class DebPackage:
+    """The contents of one .deb file: control fields, conffiles, maintainer
+    scripts and the index of the data tarball."""
+
+    def __init__(self, path):
+        self.path = path
+        self.control = {}
+        self.conffiles = []
+        self.scripts = {}
+        self.files = {}
+        for name, data in _ar_members(path):
+            if name.startswith("control.tar"):
+                self._read_control(_open_tarball(name, data))
+            elif name.startswith("data.tar"):
+                self._data = _open_tarball(name, data)
+                for member in self._data.getmembers():
+                    entry = DebEntry(self, member)
+                    self.files[entry.path] = entry
+        self.name = self.control.get("Package")
+
+    def _read_control(self, tar):
+        for member in tar.getmembers():
+            if not member.isfile():
+                continue
+            name = os.path.basename(member.name)
+            content = tar.extractfile(member).read().decode()
+            if name == "control":
+                field = None
+                for line in content.splitlines():
+                    if line.startswith((" ", "\t")) and field:
+                        self.control[field] += "\n" + line.strip()
+                    elif ":" in line:
+                        field, value = line.split(":", 1)
+                        self.control[field] = value.strip()
+            elif name == "conffiles":
+                self.conffiles = content.split()
+            elif name in MAINTAINER_SCRIPTS:
+                self.scripts[name] = content
+
+    def read(self, path):
+        return self._data.extractfile(self.files[path].member).read()
+
+
+class DebContents:
+    """The merged contents of several packages, as installed together."""
+
+    def __init__(self, packages):
+        self.packages = packages
+        self.files = {}
+        self.conffiles = []
+        for package in packages:
+            self.files.update(package.files)
+            self.conffiles += package.conffiles
+
+    def package(self, name):
+        for package in self.packages:
+            if package.name == name:
+                return package
+        raise KeyError(name)
+
+    def entry(self, path, follow_symlinks=True):
+        """Returns the entry of the path, following symlinks like the checks
+        on an installed system do, or None when the packages do not ship it."""
+        path = _normalize(path)
+        for _ in range(10):
+            entry = self.files.get(path)
+            if entry is None or not follow_symlinks or not entry.is_symlink():
+                return entry
+            path = _normalize(os.path.join(os.path.dirname(path), entry.linkname))
+        raise ValueError(f"Too many levels of symbolic links for {path}")
+
+    def read(self, path):
+        entry = self.entry(path)
+        if entry is None or not entry.is_file():
+            raise FileNotFoundError(path)
+        return entry.package.read(entry.path)
+
+    def verify_files(self, files):
+        """Checks the files in the format of the all_files lists of the tests,
+        reporting all the mismatches together."""
+        errors = []
+        for file in files:
+            name = file["name"]
+            entry = self.entry(name)
+            if entry is None:
+                errors.append(f"{name}: not shipped")
+            elif file["type"] == "executable":
+                if not entry.is_file() or not entry.is_executable():
+                    errors.append(f"{name}: not an executable file")
+            elif file["type"] == "directory":
+                if not entry.is_dir():
+                    errors.append(f"{name}: not a directory")
+            elif file["type"] == "file":
+                if not entry.is_file():
+                    errors.append(f"{name}: not a file")
+                elif (
+                    "contents" in file and self.read(name).decode() != file["contents"]
+                ):
+                    errors.append(f"{name}: unexpected contents")
+            else:
+                raise Exception("Unknown file type check")
+        assert not errors, "\n".join(errors)
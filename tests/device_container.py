@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Device containers of the pytest-xdist workers.
+
+With MENDER_TEST_DEVICE_IMAGE set, the device tests run in a container of that
+image instead of the machine running pytest, so that every pytest-xdist worker
+has a device of its own. The container is named after the worker and, as it
+uses the host network, its SSH server listens on a port of its own.
+"""
+
+import os
+import shlex
+import subprocess
+import time
+
+from mender_test_containers.helpers import Result as SSHResult
+
+DEVICE_IMAGE = os.getenv("MENDER_TEST_DEVICE_IMAGE")
+
+# gw0 without pytest-xdist, or with a single worker
+WORKER = os.getenv("PYTEST_XDIST_WORKER", "gw0")
+DEVICE_CONTAINER_NAME = f"mender-dist-packages-device-{WORKER}"
+DEVICE_SSH_PORT = 8822 + int(WORKER[2:])
+
+DEVICE_IMAGE_TAG = "mender-dist-packages-device:latest"
+
+# Requirements of the tests, baked into DEVICE_IMAGE_TAG
+DEVICE_IMAGE_DOCKERFILE = """
+FROM {image}
+RUN apt-get update && apt-get install -y bash ca-certificates gnupg openssh-server sudo wget && mkdir -p /run/sshd
+"""
+
+SSH_BOOT_TIMEOUT = 60
+
+
+class DeviceResult(SSHResult):
+    def __init__(self, stdout, stderr, exited):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exited = exited
+        self.return_code = exited
+        self.ok = exited == 0
+        self.failed = not self.ok
+
+
+class DeviceConnection:
+    """Runs commands on, and copies files to, the device container as root."""
+
+    def __init__(self, port, key_filename):
+        self.port = port
+        self.key_filename = key_filename
+
+    def _options(self):
+        return [
+            "-o",
+            "StrictHostKeyChecking=no",
+            "-o",
+            "UserKnownHostsFile=/dev/null",
+            "-o",
+            "LogLevel=ERROR",
+            "-i",
+            self.key_filename,
+        ]
+
+    def run(self, command, warn=False, **kwargs):
+        res = subprocess.run(
+            ["ssh", *self._options(), "-p", str(self.port), "root@localhost", command],
+            capture_output=True,
+            text=True,
+        )
+        if res.returncode != 0 and not warn:
+            print(res.stdout, res.stderr)
+            raise subprocess.CalledProcessError(
+                res.returncode, command, res.stdout, res.stderr
+            )
+        return DeviceResult(res.stdout, res.stderr, res.returncode)
+
+    def sudo(self, command, warn=False, **kwargs):
+        return self.run("sudo sh -c " + shlex.quote(command), warn=warn)
+
+    def put(self, file, remote_path="."):
+        subprocess.check_call(
+            [
+                "scp",
+                *self._options(),
+                "-P",
+                str(self.port),
+                file,
+                f"root@localhost:{remote_path}",
+            ]
+        )
+
+
+class DeviceContainer:
+    def __init__(self, name, port, conn):
+        self.name = name
+        self.port = port
+        self.conn = conn
+
+    def stop(self):
+        subprocess.run(["docker", "rm", "-f", self.name], capture_output=True)
+
+
+def build_device_image():
+    subprocess.run(
+        ["docker", "build", "--network=host", "--tag", DEVICE_IMAGE_TAG, "-"],
+        input=DEVICE_IMAGE_DOCKERFILE.format(image=DEVICE_IMAGE).encode(),
+        check=True,
+    )
+
+
+def start_device_container(key_dir):
+    """Starts the device container of this worker, accepting a key generated
+    in key_dir. Returns the DeviceContainer, or None when its SSH server did
+    not come up in time."""
+
+    key_filename = os.path.join(key_dir, "id_ed25519")
+    subprocess.check_call(
+        ["ssh-keygen", "-q", "-t", "ed25519", "-N", "", "-f", key_filename]
+    )
+
+    # Left over by an aborted session
+    subprocess.run(["docker", "rm", "-f", DEVICE_CONTAINER_NAME], capture_output=True)
+    subprocess.check_call(
+        [
+            "docker",
+            "run",
+            "--detach",
+            "--network=host",
+            "--name",
+            DEVICE_CONTAINER_NAME,
+            DEVICE_IMAGE_TAG,
+            "/usr/sbin/sshd",
+            "-D",
+            "-p",
+            str(DEVICE_SSH_PORT),
+        ]
+    )
+    with open(key_filename + ".pub", "rb") as f:
+        subprocess.run(
+            [
+                "docker",
+                "exec",
+                "-i",
+                DEVICE_CONTAINER_NAME,
+                "sh",
+                "-c",
+                "mkdir -p /root/.ssh && cat > /root/.ssh/authorized_keys",
+            ],
+            stdin=f,
+            check=True,
+        )
+
+    device = DeviceContainer(
+        DEVICE_CONTAINER_NAME,
+        DEVICE_SSH_PORT,
+        DeviceConnection(DEVICE_SSH_PORT, key_filename),
+    )
+    deadline = time.monotonic() + SSH_BOOT_TIMEOUT
+    while device.conn.run("true", warn=True).failed:
+        if time.monotonic() > deadline:
+            device.stop()
+            return None
+        time.sleep(1)
+    return device
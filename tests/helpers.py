@@ -13,10 +13,12 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import base64
+import hashlib
 import os
-
-from conftest import get_distro_family, get_distro_version
-from mender_test_containers.helpers import Result as SSHResult
+import shlex
+import tarfile
+import tempfile
 
 tests_path = os.path.dirname(os.path.realpath(__file__))
 output_path = os.path.normpath(os.path.join(tests_path, "..", "output"))
@@ -35,6 +37,20 @@ COMMERCIAL_PACKAGES = [
 DEFAULT_PACKAGE_ARCH = "armhf"
 
 
+def get_distro_family():
+    # Inherit this from the CI calling the tests
+    distro_family = os.getenv("OS_FAMILY", "")
+    assert distro_family != ""
+    return distro_family
+
+
+def get_distro_version():
+    # Inherit this from the CI calling the tests
+    distro_version = os.getenv("OS_VERSION_NAME", "")
+    assert distro_version != ""
+    return distro_version
+
+
 # Returns path were to find the package to install
 def packages_path(package, package_arch=DEFAULT_PACKAGE_ARCH):
     if package_arch == "all":
@@ -70,25 +86,151 @@ def package_filename_path(
 def upload_deb_package(
     ssh_connection, package_version, package_name, package_arch=DEFAULT_PACKAGE_ARCH
 ):
-    ssh_connection.put(
-        package_filename_path(package_version, package_name, package_arch)
+    stage_deb_packages(
+        ssh_connection,
+        [package_filename_path(package_version, package_name, package_arch)],
     )
 
 
+# sha256 of the local packages, keyed on (path, size, mtime)
+_local_checksums = {}
+
+
+def _local_checksum(path):
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime)
+    if key not in _local_checksums:
+        with open(path, "rb") as f:
+            _local_checksums[key] = hashlib.sha256(f.read()).hexdigest()
+    return _local_checksums[key]
+
+
+def stage_deb_packages(ssh_connection, paths, dest="."):
+    """Upload the given local packages to the dest directory of the device,
+    relative to the home directory of the user. The packages whose checksum
+    matches a copy already on the device are skipped, and the others are sent
+    together in one archive. Returns the remote paths of the packages."""
+
+    names = [os.path.basename(path) for path in paths]
+    res = ssh_connection.run(
+        f"mkdir -p {dest} && cd {dest} && sha256sum {' '.join(names)} 2>/dev/null",
+        warn=True,
+    )
+    output = res.stdout if isinstance(res.stdout, str) else res.stdout.decode()
+    remote_checksums = {}
+    for line in output.splitlines():
+        checksum, name = line.split(maxsplit=1)
+        remote_checksums[name] = checksum
+
+    missing = [
+        path
+        for path, name in zip(paths, names)
+        if remote_checksums.get(name) != _local_checksum(path)
+    ]
+    if missing:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive = os.path.join(tmpdir, f"deb-packages-{os.getpid()}.tar")
+            # The packages are already compressed
+            with tarfile.open(archive, "w") as tar:
+                for path in missing:
+                    tar.add(path, arcname=os.path.basename(path))
+            ssh_connection.put(archive)
+            ssh_connection.run(
+                f"tar -xf {os.path.basename(archive)} -C {dest} && rm {os.path.basename(archive)}"
+            )
+
+    return [os.path.join(dest, name) for name in names]
+
+
 def check_installed(conn, pkg, installed=True):
     """Check whether the given package is installed on the device given by conn.
     Check the specific dpkg Status to differentiate between installed (install ok installed)
     and other status like removed but not purged (deinstall ok config-files)"""
 
-    res = conn.run(f"dpkg --status {pkg}", warn=True)
-    if isinstance(res, SSHResult):
-        retcode = res.return_code
-        output = res.stdout
-    else:
-        retcode = res.returncode
-        output = res.stdout.decode()
-
-    if installed:
-        assert "Status: install ok installed" in output
-    else:
-        assert retcode != 0 or "Status: install ok installed" not in output
+    check_installed_many(conn, {pkg: installed})
+
+
+def check_installed_many(conn, packages):
+    """Check the state of several packages on the device given by conn with a
+    single dpkg-query call. packages maps each package name to whether it is
+    expected to be installed. All the mismatches are reported together and the
+    installed version of every package (None when not installed) is returned."""
+
+    names = " ".join(packages)
+    res = conn.run(
+        f"dpkg-query --show --showformat='${{Package}}\\t${{Status}}\\t${{Version}}\\n' {names}",
+        warn=True,
+    )
+    output = res.stdout if isinstance(res.stdout, str) else res.stdout.decode()
+
+    versions = dict.fromkeys(packages)
+    for line in output.splitlines():
+        name, status, version = line.split("\t")
+        if name in versions and status == "install ok installed":
+            versions[name] = version
+
+    errors = []
+    for name, installed in packages.items():
+        if installed and versions[name] is None:
+            errors.append(f"{name}: not installed")
+        elif not installed and versions[name] is not None:
+            errors.append(f"{name}: installed ({versions[name]})")
+    assert not errors, "\n".join(errors)
+    return versions
+
+
+# Prints "<index> <flags> [<base64 contents>]" for a path, where the flags are
+# e(xists), f(ile), d(irectory) and x (executable), or - for none of them.
+_REMOTE_FILE_CHECK = r"""check() {
+    flags=""
+    [ -e "$2" ] && flags="${flags}e"
+    [ -f "$2" ] && flags="${flags}f"
+    [ -d "$2" ] && flags="${flags}d"
+    [ -x "$2" ] && flags="${flags}x"
+    if [ "$3" = contents ] && [ -f "$2" ]; then
+        echo "$1 ${flags:--} $(base64 -w0 "$2")"
+    else
+        echo "$1 ${flags:--}"
+    fi
+}
+"""
+
+
+def verify_remote_files(conn, files):
+    """Check the given files on the device given by conn with a single command.
+    The files are given as dictionaries with the "name" of the path, its "type"
+    (executable, directory, file or missing) and optionally the expected
+    "contents" of a file. All the mismatches are reported together."""
+
+    script = _REMOTE_FILE_CHECK
+    for index, file in enumerate(files):
+        script += "check %d %s %s\n" % (
+            index,
+            shlex.quote(file["name"]),
+            "contents" if "contents" in file else "-",
+        )
+    res = conn.run(f"sh -c {shlex.quote(script)}")
+    output = res.stdout if isinstance(res.stdout, str) else res.stdout.decode()
+
+    results = {}
+    for line in output.splitlines():
+        index, flags, *contents = line.split(" ")
+        results[int(index)] = (flags, contents[0] if contents else "")
+
+    expected_flags = {"executable": "x", "directory": "d", "file": "f"}
+    errors = []
+    for index, file in enumerate(files):
+        name = file["name"]
+        flags, contents = results[index]
+        if file["type"] == "missing":
+            if "e" in flags:
+                errors.append(f"{name}: exists")
+            continue
+        if file["type"] not in expected_flags:
+            raise Exception("Unknown file type check")
+        if expected_flags[file["type"]] not in flags:
+            errors.append(f"{name}: not a {file['type']} (flags: {flags})")
+        elif "contents" in file:
+            if base64.b64decode(contents).decode() != file["contents"]:
+                errors.append(f"{name}: unexpected contents")
+    assert not errors, "\n".join(errors)
@@ -0,0 +1,233 @@
+#!/usr/bin/python3
+# Copyright 2026 Northern.tech AS
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Latency profiling of the test suites.
+
+With --latency-profile FILE, the duration of every fixture setup and
+teardown, and the duration and byte counts of every run, sudo and put call on
+the device connections, are recorded per test. A JSON report is written to
+FILE and a text summary of the slowest commands and fixtures to FILE with a
+.txt extension, and printed at the end of the session.
+
+The plugin is registered by tests/conftest.py. The install script tests use it
+with `-p tests.latency_profile`.
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+# Fixtures returning the connections to the device
+CONNECTION_FIXTURES = ["setup_tester_ssh_connection", "generic_container"]
+
+PROFILED_METHODS = ["run", "sudo", "put"]
+
+# Kinds of the records of the fixture setups and teardowns
+FIXTURE_KINDS = ["fixture", "teardown"]
+
+SLOWEST_COUNT = 10
+
+
+def _size(value):
+    return len(value) if isinstance(value, (str, bytes)) else 0
+
+
+class LatencyProfile:
+    def __init__(self, path):
+        self.path = path
+        self.test = None
+        self.records = []
+        # Connections already wrapped, by id
+        self.wrapped = set()
+        # Start of the teardown of the fixtures being finalized, by id
+        self.teardown_starts = {}
+
+    def record(self, kind, name, duration, sent=0, received=0):
+        self.records.append(
+            {
+                "test": self.test,
+                "kind": kind,
+                "name": name,
+                "duration": duration,
+                "sent": sent,
+                "received": received,
+            }
+        )
+
+    def wrap_connection(self, conn):
+        if id(conn) in self.wrapped:
+            return
+        self.wrapped.add(id(conn))
+        for method in PROFILED_METHODS:
+            func = getattr(conn, method, None)
+            if func is not None:
+                setattr(conn, method, self._profiled(method, func))
+
+    def _profiled(self, method, func):
+        def profiled(*args, **kwargs):
+            command = str(args[0]) if args else ""
+            result = None
+            start = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                duration = time.monotonic() - start
+                if method == "put":
+                    sent = os.path.getsize(command) if os.path.isfile(command) else 0
+                    received = 0
+                else:
+                    sent = len(command)
+                    received = _size(getattr(result, "stdout", None)) + _size(
+                        getattr(result, "stderr", None)
+                    )
+                self.record(method, command, duration, sent, received)
+
+        return profiled
+
+    def report(self):
+        tests = {}
+        for record in self.records:
+            test = tests.setdefault(
+                record["test"] or "<session>",
+                {"duration": 0.0, "sent": 0, "received": 0, "records": []},
+            )
+            test["duration"] += record["duration"]
+            test["sent"] += record["sent"]
+            test["received"] += record["received"]
+            test["records"].append(record)
+        for test in tests.values():
+            test["records"].sort(key=lambda r: r["duration"], reverse=True)
+
+        slowest = sorted(self.records, key=lambda r: r["duration"], reverse=True)
+        return {
+            "tests": tests,
+            "slowest_commands": [r for r in slowest if r["kind"] in PROFILED_METHODS][
+                :SLOWEST_COUNT
+            ],
+            "slowest_fixtures": [r for r in slowest if r["kind"] in FIXTURE_KINDS][
+                :SLOWEST_COUNT
+            ],
+        }
+
+    def summary(self, report):
+        lines = []
+
+        def add_records(title, records):
+            lines.append(title)
+            for r in records:
+                lines.append(
+                    f"{r['duration']:8.2f}s {r['kind']:<8} {r['name'][:80]} ({r['test']})"
+                )
+            lines.append("")
+
+        add_records("Slowest commands:", report["slowest_commands"])
+        add_records("Slowest fixtures:", report["slowest_fixtures"])
+        lines.append("Time spent in commands and fixtures per test:")
+        for name, test in sorted(
+            report["tests"].items(), key=lambda t: t[1]["duration"], reverse=True
+        ):
+            lines.append(
+                f"{test['duration']:8.2f}s {name} "
+                f"(sent {test['sent']} bytes, received {test['received']} bytes)"
+            )
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        path = self.path
+        worker = os.getenv("PYTEST_XDIST_WORKER")
+        if worker:
+            base, ext = os.path.splitext(path)
+            path = f"{base}-{worker}{ext}"
+        report = self.report()
+        summary = self.summary(report)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        with open(os.path.splitext(path)[0] + ".txt", "w") as f:
+            f.write(summary)
+        return summary
+
+
+profile_key = pytest.StashKey[LatencyProfile]()
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--latency-profile",
+        required=False,
+        metavar="FILE",
+        help="write the duration of the fixtures and device commands to FILE",
+    )
+
+
+def pytest_configure(config):
+    path = config.getoption("--latency-profile")
+    if path:
+        config.stash[profile_key] = LatencyProfile(path)
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    profile = item.config.stash.get(profile_key, None)
+    if profile is not None:
+        profile.test = item.nodeid
+    yield
+    if profile is not None:
+        profile.test = None
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_fixture_setup(fixturedef, request):
+    profile = request.config.stash.get(profile_key, None)
+    start = time.monotonic()
+    outcome = yield
+    if profile is None:
+        return
+    profile.record("fixture", fixturedef.argname, time.monotonic() - start)
+    if fixturedef.argname in CONNECTION_FIXTURES and outcome.excinfo is None:
+        profile.wrap_connection(outcome.get_result())
+
+    # The finalizers run in reverse order, so this one, added after those of
+    # the fixture itself, runs right before them
+    def start_teardown():
+        profile.teardown_starts[id(fixturedef)] = time.monotonic()
+
+    fixturedef.addfinalizer(start_teardown)
+
+
+def pytest_fixture_post_finalizer(fixturedef, request):
+    profile = request.config.stash.get(profile_key, None)
+    if profile is None:
+        return
+    start = profile.teardown_starts.pop(id(fixturedef), None)
+    if start is not None:
+        profile.record("teardown", fixturedef.argname, time.monotonic() - start)
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    profile = config.stash.get(profile_key, None)
+    # With pytest-xdist, the records are in the files of the workers
+    if profile is not None and profile.records:
+        terminalreporter.section("latency profile")
+        terminalreporter.write(profile.write())
+
+
+def pytest_sessionfinish(session, exitstatus):
+    # Workers of pytest-xdist have no terminal summary, write their own files
+    profile = session.config.stash.get(profile_key, None)
+    if profile is not None and os.getenv("PYTEST_XDIST_WORKER"):
+        profile.write()
@@ -13,9 +13,22 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import base64
+import hashlib
+import os
+import re
+import time
+
 import pytest
 
-from helpers import package_filename, upload_deb_package, check_installed
+from helpers import (
+    package_filename,
+    package_filename_path,
+    stage_deb_packages,
+    check_installed,
+    check_installed_many,
+    verify_remote_files,
+)
 from mender_test_containers.helpers import *
 
 pytestmark = pytest.mark.requires_option("--mender-client-deb-version")
@@ -23,22 +36,6 @@ pytestmark = pytest.mark.requires_option("--mender-client-deb-version")
 expected_copyright_from_l2_md5sum = "39a30292da940b7ce011150e8c8d5e4f"
 
 
-def verify_file_exists(ssh_conn, files):
-    for file in files:
-        file_name = file["name"]
-        if file["type"] == "executable":
-            ssh_conn.run(f"test -x {file_name}")
-        elif file["type"] == "directory":
-            ssh_conn.run(f"test -d {file_name}")
-        elif file["type"] == "file":
-            ssh_conn.run(f"test -f {file_name}")
-        elif file.get("contents", False):
-            result = ssh_conn.run(f"cat {file_name}")
-            assert file["contents"] == result.stdout
-        else:
-            raise Exception("Unknown file type check")
-
-
 all_files = [
     {
         "name": "/usr/bin/mender-update",
@@ -217,21 +214,42 @@ class PackageMenderClientChecker:
         if mender_version != "master":
             assert mender_version in result.stdout
 
-    def check_installed_files(self, ssh_connection):
-        verify_file_exists(ssh_connection, all_files)
-        # Northern.tech copyright file
-        ssh_connection.run("test -f /usr/share/doc/mender-client4/copyright")
-        result = ssh_connection.run(
-            "tail -n +2 /usr/share/doc/mender-client4/copyright | md5sum"
+    def check_systemd_service(self, ssh_connection):
+        verify_remote_files(
+            ssh_connection,
+            [
+                {
+                    "name": "/etc/systemd/system/multi-user.target.wants/mender-authd.service",
+                    "type": "file",
+                },
+                {
+                    "name": "/etc/systemd/system/multi-user.target.wants/mender-updated.service",
+                    "type": "file",
+                },
+            ],
         )
-        assert result.stdout.split(" ")[0] == expected_copyright_from_l2_md5sum
 
-    def check_systemd_service(self, ssh_connection):
-        ssh_connection.run(
-            "test -f /etc/systemd/system/multi-user.target.wants/mender-authd.service"
+
+class TestPackageMenderClientContents:
+    """Checks the contents of the built packages, without a test container."""
+
+    def test_installed_files(self, deb_contents, mender_dist_packages_versions):
+        contents = deb_contents(
+            *[
+                package_filename_path(
+                    mender_dist_packages_versions["mender-client4"], name
+                )
+                for name in ["mender-client4", "mender-auth", "mender-update"]
+            ]
         )
-        ssh_connection.run(
-            "test -f /etc/systemd/system/multi-user.target.wants/mender-updated.service"
+        contents.verify_files(all_files)
+
+        # Northern.tech copyright file
+        copyright = contents.read("/usr/share/doc/mender-client4/copyright")
+        copyright_from_l2 = copyright.split(b"\n", 1)[1]
+        assert (
+            hashlib.md5(copyright_from_l2).hexdigest()
+            == expected_copyright_from_l2_md5sum
         )
 
 
@@ -239,6 +257,10 @@ class TestPackageMenderClientDefaults(PackageMenderClientChecker):
     """Tests installation, setup, start, removal and purge of mender-client deb
     package with the non-interactive method (i.e. default configuration).
 
+    It installs the packages on its own and does not use mender_configured_device.
+    It leaves mender-client4 purged, the classes using mender_configured_device
+    install it again.
+
     """
 
     @pytest.mark.usefixtures("setup_test_container")
@@ -251,23 +273,15 @@ class TestPackageMenderClientDefaults(PackageMenderClientChecker):
             "sudo apt-get update --allow-releaseinfo-change-suite"
         )
 
-        # Client meta package
-        upload_deb_package(
-            setup_tester_ssh_connection,
-            mender_dist_packages_versions["mender-client4"],
-            package_name="mender-client4",
-        )
-        # Upload mender-auth
-        upload_deb_package(
+        # Upload the client meta package, mender-auth and mender-update
+        stage_deb_packages(
             setup_tester_ssh_connection,
-            mender_dist_packages_versions["mender-client4"],
-            package_name="mender-auth",
-        )
-        # Upload mender-update
-        upload_deb_package(
-            setup_tester_ssh_connection,
-            mender_dist_packages_versions["mender-client4"],
-            package_name="mender-update",
+            [
+                package_filename_path(
+                    mender_dist_packages_versions["mender-client4"], name
+                )
+                for name in ["mender-client4", "mender-auth", "mender-update"]
+            ],
         )
 
         # Install the deb packages. On failure, install the missing dependencies.
@@ -299,8 +313,6 @@ class TestPackageMenderClientDefaults(PackageMenderClientChecker):
         )
         check_installed(setup_tester_ssh_connection, "mender-client4")
 
-        self.check_installed_files(setup_tester_ssh_connection)
-
         self.check_mender_client_version(setup_tester_ssh_connection, mender_version)
 
         self.check_systemd_service(setup_tester_ssh_connection)
@@ -325,5 +337,196 @@ class TestPackageMenderClientDefaults(PackageMenderClientChecker):
         result = setup_tester_ssh_connection.run("sudo dpkg --purge mender-client4")
         assert result.return_code == 0
         check_installed(setup_tester_ssh_connection, "mender-client4", installed=False)
-        setup_tester_ssh_connection.run("test ! -f /etc/mender/mender.conf")
-        setup_tester_ssh_connection.run("test ! -f /var/lib/mender/device_type")
+        verify_remote_files(
+            setup_tester_ssh_connection,
+            [
+                {"name": "/etc/mender/mender.conf", "type": "missing"},
+                {"name": "/var/lib/mender/device_type", "type": "missing"},
+            ],
+        )
+
+
+# The maintainer scripts of the mender-client4 packages are timed against the
+# ones of the 5.0.x recipe, which still divert and restore the files of the old
+# mender-client one by one.
+RECIPES_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "recipes", "mender-client4"
+)
+CURRENT_RECIPE = "debian-master"
+BASELINE_RECIPE = "debian-5.0.x"
+
+# Maintainer scripts handling the diversions, by package and by their name in
+# the package
+DIVERSION_SCRIPTS = {
+    "mender-client4": {"postinst": "postinst"},
+    "mender-auth": {"preinst": "mender-auth.preinst", "postrm": "mender-auth.postrm"},
+    "mender-update": {
+        "preinst": "mender-update.preinst",
+        "postrm": "mender-update.postrm",
+    },
+}
+
+
+def read_recipe_file(recipe, name):
+    with open(os.path.join(RECIPES_DIR, recipe, name)) as f:
+        return f.read()
+
+
+def action_case(script):
+    """Returns the case statement on the action of a maintainer script, which
+    holds all its logic. debhelper and mender-deb-package only add to the
+    scripts outside of it."""
+    start = script.index('case "$ACTION" in')
+    end = script.index("\nesac\n", start) + len("\nesac\n")
+    return script[start:end]
+
+
+def diverted_files():
+    """Returns the files of the old mender-client diverted by the preinst
+    scripts of mender-auth and mender-update."""
+    files = []
+    for name in ["mender-auth.preinst", "mender-update.preinst"]:
+        files += re.findall(
+            r"^\s+(/\S+)(?: \\|; do)$",
+            read_recipe_file(CURRENT_RECIPE, name),
+            flags=re.MULTILINE,
+        )
+    return files
+
+
+@pytest.mark.usefixtures("mender_configured_device")
+class TestPackageMenderClientDiversions:
+    """Measures the time to install and upgrade mender-client4, mender-auth and
+    mender-update, whose maintainer scripts handle the diversions of the files
+    of the old mender-client, and checks that no diversions are left behind.
+
+    """
+
+    PACKAGES = ["mender-auth", "mender-update", "mender-client4"]
+
+    def stage_client_packages(self, ssh_connection, mender_dist_packages_versions):
+        return stage_deb_packages(
+            ssh_connection,
+            [
+                package_filename_path(
+                    mender_dist_packages_versions["mender-client4"], name
+                )
+                for name in self.PACKAGES
+            ],
+        )
+
+    def repack_with_baseline_scripts(self, ssh_connection, deb, package):
+        """Builds a copy of the given package on the device with the maintainer
+        scripts of the baseline recipe, and returns its path."""
+
+        workdir = f"baseline-{package}"
+        ssh_connection.run(f"rm -rf {workdir} && dpkg-deb -R {deb} {workdir}")
+        for script, name in DIVERSION_SCRIPTS[package].items():
+            path = f"{workdir}/DEBIAN/{script}"
+            built = ssh_connection.run(f"cat {path}").stdout
+            current = action_case(read_recipe_file(CURRENT_RECIPE, name))
+            baseline = action_case(read_recipe_file(BASELINE_RECIPE, name))
+            assert current in built, f"{path} does not match the {name} recipe"
+            encoded = base64.b64encode(
+                built.replace(current, baseline).encode()
+            ).decode()
+            ssh_connection.run(f"echo {encoded} | base64 -d > {path}")
+        ssh_connection.run(f"dpkg-deb -b {workdir} {workdir}.deb && rm -rf {workdir}")
+        return f"{workdir}.deb"
+
+    def purge_client_packages(self, ssh_connection):
+        # Other packages of the configured device depend on them
+        ssh_connection.run(
+            "sudo dpkg --purge --force-depends " + " ".join(self.PACKAGES)
+        )
+
+    def timed_install(self, ssh_connection, debs):
+        start = time.monotonic()
+        ssh_connection.run("sudo dpkg --install " + " ".join(debs))
+        return time.monotonic() - start
+
+    def check_no_diversions(self, ssh_connection):
+        result = ssh_connection.run("dpkg-divert --list '*mender*'")
+        assert result.stdout.strip() == ""
+
+    def test_install_upgrade_time(
+        self,
+        setup_tester_ssh_connection,
+        mender_dist_packages_versions,
+        record_property,
+    ):
+        conn = setup_tester_ssh_connection
+        debs = self.stage_client_packages(conn, mender_dist_packages_versions)
+        variants = {
+            "baseline": [
+                self.repack_with_baseline_scripts(conn, deb, package)
+                for deb, package in zip(debs, self.PACKAGES)
+            ],
+            "current": debs,
+        }
+
+        for variant, variant_debs in variants.items():
+            self.purge_client_packages(conn)
+            install_time = self.timed_install(conn, variant_debs)
+            check_installed_many(conn, dict.fromkeys(self.PACKAGES, True))
+            self.check_no_diversions(conn)
+
+            # Installing the same version again goes through the upgrade paths
+            # of the maintainer scripts
+            upgrade_time = self.timed_install(conn, variant_debs)
+            self.check_no_diversions(conn)
+
+            record_property(f"{variant}_install_time", f"{install_time:.2f}")
+            record_property(f"{variant}_upgrade_time", f"{upgrade_time:.2f}")
+
+    def test_install_over_mender_client3(
+        self, setup_tester_ssh_connection, mender_dist_packages_versions
+    ):
+        conn = setup_tester_ssh_connection
+        debs = self.stage_client_packages(conn, mender_dist_packages_versions)
+        self.purge_client_packages(conn)
+
+        # A mender-client 3.x stand-in owning the files that mender-auth and
+        # mender-update take over
+        files = diverted_files()
+        conn.run(
+            "rm -rf mender-client3 && mkdir -p mender-client3/DEBIAN && "
+            + " && ".join(
+                f"mkdir -p mender-client3{os.path.dirname(file)} && "
+                f"echo mender-client3 > mender-client3{file}"
+                for file in files
+            )
+        )
+        conn.run(
+            "printf 'Package: mender-client\\nVersion: 3.5.3-1\\n"
+            "Architecture: all\\nMaintainer: The Mender Team <mender@northern.tech>\\n"
+            "Description: Mender client 3.x stand-in\\n' > mender-client3/DEBIAN/control"
+            " && dpkg-deb -b mender-client3 mender-client3.deb && rm -rf mender-client3"
+            " && sudo dpkg --install mender-client3.deb"
+        )
+        # A diversion left by an interrupted upgrade must not make the preinst
+        # scripts fail
+        conn.run(f"sudo dpkg-divert --package mender-auth --add --no-rename {files[0]}")
+
+        conn.run(
+            "sudo apt-get install --assume-yes " + " ".join(f"./{deb}" for deb in debs)
+        )
+        check_installed_many(
+            conn,
+            {
+                "mender-client": False,
+                "mender-auth": True,
+                "mender-update": True,
+                "mender-client4": True,
+            },
+        )
+        self.check_no_diversions(conn)
+        verify_remote_files(
+            conn,
+            [
+                {"name": file, "type": "executable"}
+                for file in files
+                if file.startswith("/usr/share/mender/modules/v3/")
+            ],
+        )
+        conn.run("sudo dpkg --purge mender-client")
@@ -20,7 +20,7 @@ from helpers import package_filename, upload_deb_package, check_installed
 pytestmark = pytest.mark.requires_option("--mender-client-deb-version")
 
 
-@pytest.mark.usefixtures("setup_mender_configured")
+@pytest.mark.usefixtures("mender_configured_device")
 class TestPackageDev:
     @pytest.mark.min_mender_client_version("3.0.0")
     def test_mender_client_dev(
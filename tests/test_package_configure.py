@@ -15,12 +15,17 @@
 
 import pytest
 
-from helpers import package_filename, upload_deb_package, check_installed
+from helpers import (
+    package_filename,
+    upload_deb_package,
+    check_installed,
+    verify_remote_files,
+)
 
 pytestmark = pytest.mark.requires_option("--mender-configure-deb-version")
 
 
-@pytest.mark.usefixtures("setup_mender_configured")
+@pytest.mark.usefixtures("mender_configured_device")
 class TestPackageConfigure:
     def test_mender_configure(
         self, setup_tester_ssh_connection, mender_dist_packages_versions
@@ -45,9 +50,16 @@ class TestPackageConfigure:
         check_installed(setup_tester_ssh_connection, "mender-configure")
 
         # Check mender-configure files
-        setup_tester_ssh_connection.run(
-            "test -x /usr/share/mender/modules/v3/mender-configure"
-        )
-        setup_tester_ssh_connection.run(
-            "test -x /usr/share/mender/inventory/mender-inventory-mender-configure"
+        verify_remote_files(
+            setup_tester_ssh_connection,
+            [
+                {
+                    "name": "/usr/share/mender/modules/v3/mender-configure",
+                    "type": "executable",
+                },
+                {
+                    "name": "/usr/share/mender/inventory/mender-inventory-mender-configure",
+                    "type": "executable",
+                },
+            ],
         )
@@ -15,12 +15,17 @@
 
 import pytest
 
-from helpers import package_filename, upload_deb_package, check_installed
+from helpers import (
+    package_filename,
+    upload_deb_package,
+    check_installed,
+    verify_remote_files,
+)
 
 pytestmark = pytest.mark.requires_option("--mender-connect-deb-version")
 
 
-@pytest.mark.usefixtures("setup_mender_configured")
+@pytest.mark.usefixtures("mender_configured_device")
 class TestPackageConnect:
     def test_mender_connect(
         self,
@@ -45,8 +50,11 @@ class TestPackageConnect:
         check_installed(setup_tester_ssh_connection, "mender-connect")
 
         # Check mender-connect files
-        setup_tester_ssh_connection.run("test -x /usr/bin/mender-connect")
-        setup_tester_ssh_connection.run("test -f /etc/mender/mender-connect.conf")
-        setup_tester_ssh_connection.run(
-            "test -f /lib/systemd/system/mender-connect.service"
+        verify_remote_files(
+            setup_tester_ssh_connection,
+            [
+                {"name": "/usr/bin/mender-connect", "type": "executable"},
+                {"name": "/etc/mender/mender-connect.conf", "type": "file"},
+                {"name": "/lib/systemd/system/mender-connect.service", "type": "file"},
+            ],
         )
@@ -15,7 +15,12 @@
 
 import pytest
 
-from helpers import package_filename, upload_deb_package, check_installed
+from helpers import (
+    package_filename,
+    upload_deb_package,
+    check_installed,
+    verify_remote_files,
+)
 
 pytestmark = pytest.mark.requires_option("--mender-gateway-deb-version")
 
@@ -43,8 +48,11 @@ class TestPackageGateway:
         check_installed(setup_tester_ssh_connection, "mender-gateway")
 
         # Check mender-gateway files
-        setup_tester_ssh_connection.run("test -x /usr/bin/mender-gateway")
-        setup_tester_ssh_connection.run("test -f /etc/mender/mender-gateway.conf")
-        setup_tester_ssh_connection.run(
-            "test -f /lib/systemd/system/mender-gateway.service"
+        verify_remote_files(
+            setup_tester_ssh_connection,
+            [
+                {"name": "/usr/bin/mender-gateway", "type": "executable"},
+                {"name": "/etc/mender/mender-gateway.conf", "type": "file"},
+                {"name": "/lib/systemd/system/mender-gateway.service", "type": "file"},
+            ],
         )
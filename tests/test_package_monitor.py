@@ -15,12 +15,17 @@
 
 import pytest
 
-from helpers import package_filename, upload_deb_package, check_installed
+from helpers import (
+    package_filename,
+    package_filename_path,
+    upload_deb_package,
+    check_installed,
+)
 
 pytestmark = pytest.mark.requires_option("--mender-monitor-deb-version")
 
 
-@pytest.mark.usefixtures("setup_mender_configured")
+@pytest.mark.usefixtures("mender_configured_device")
 class TestPackageMonitor:
     @pytest.mark.commercial
     def test_mender_monitor(
@@ -52,12 +57,28 @@ class TestPackageMonitor:
         )
         check_installed(setup_tester_ssh_connection, "mender-monitor")
 
-        # Check mender-monitor files
-        setup_tester_ssh_connection.run(
-            "test -x /usr/share/mender-monitor/mender-monitord"
+
+class TestPackageMonitorContents:
+    @pytest.mark.commercial
+    def test_mender_monitor_files(self, deb_contents, mender_dist_packages_versions):
+        contents = deb_contents(
+            package_filename_path(
+                mender_dist_packages_versions["mender-monitor"],
+                "mender-monitor",
+                "all",
+            )
         )
-        setup_tester_ssh_connection.run("test -x /etc/mender-monitor/monitor.d/log.sh")
-        setup_tester_ssh_connection.run("test -d /etc/mender-monitor/monitor.d/enabled")
-        setup_tester_ssh_connection.run(
-            "test -d /etc/mender-monitor/monitor.d/available"
+        contents.verify_files(
+            [
+                {
+                    "name": "/usr/share/mender-monitor/mender-monitord",
+                    "type": "executable",
+                },
+                {"name": "/etc/mender-monitor/monitor.d/log.sh", "type": "executable"},
+                {"name": "/etc/mender-monitor/monitor.d/enabled", "type": "directory"},
+                {
+                    "name": "/etc/mender-monitor/monitor.d/available",
+                    "type": "directory",
+                },
+            ]
         )
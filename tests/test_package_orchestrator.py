@@ -13,30 +13,69 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
-import os
 import pytest
 
-from helpers import package_filename, upload_deb_package, check_installed
+from apt_repo import enable_local_apt_repo, packages_index
 
+from helpers import (
+    package_filename,
+    package_filename_path,
+    upload_deb_package,
+    stage_deb_packages,
+    check_installed,
+    check_installed_many,
+)
 
-# Copied from test_install_mender_sh
-def prepare_local_apt_repo(container, packages_path):
-    # Configure a local APT repo with dpkg-dev. See:
-    # https://askubuntu.com/questions/458748/is-it-possible-to-add-a-location-folder-on-my-hard-disk-to-sources-list
-    container.run("apt install -y dpkg-dev")
-    container.run(
-        f"cd {packages_path} && dpkg-scanpackages . /dev/null | gzip -9c > Packages.gz"
-    )
-    sources_list_file = (
-        f"/etc/apt/sources.list.d/{os.path.basename(packages_path)}.list"
-    )
-    container.run(
-        f"echo deb [trusted=yes] file:{packages_path} ./ > {sources_list_file}"
-    )
-    container.run("apt update")
 
-
-@pytest.mark.usefixtures("setup_mender_configured")
+class TestPackageOrchestratorContents:
+    @pytest.mark.commercial
+    def test_mender_orchestrator_split_files(
+        self, deb_contents, mender_dist_packages_versions
+    ):
+        contents = deb_contents(
+            package_filename_path(
+                mender_dist_packages_versions["mender-orchestrator-support"],
+                "mender-orchestrator-support",
+                "all",
+            ),
+            package_filename_path(
+                mender_dist_packages_versions["mender-orchestrator-support"],
+                "mender-orchestrator-demo",
+                "all",
+            ),
+        )
+        contents.verify_files(
+            [
+                {
+                    "name": "/usr/share/mender/inventory/mender-inventory-orchestrator-inventory",
+                    "type": "executable",
+                },
+                {
+                    "name": "/usr/share/mender/modules/v3/mender-orchestrator-manifest",
+                    "type": "executable",
+                },
+                {
+                    "name": "/usr/share/mender-orchestrator/interfaces/v1/rootfs-image",
+                    "type": "executable",
+                },
+                {"name": "/data/mender-orchestrator/topology.yaml", "type": "file"},
+                {
+                    "name": "/data/mender-orchestrator/mock-instances/0",
+                    "type": "directory",
+                },
+                {
+                    "name": "/data/mender-orchestrator/mock-instances/1",
+                    "type": "directory",
+                },
+                {
+                    "name": "/data/mender-orchestrator/mock-instances/2",
+                    "type": "directory",
+                },
+            ]
+        )
+
+
+@pytest.mark.usefixtures("mender_configured_device")
 class TestPackageOrchestratorSplit:
     @pytest.mark.commercial
     def test_mender_orchestrator_split(
@@ -74,15 +113,6 @@ class TestPackageOrchestratorSplit:
             )
 
             check_installed(setup_tester_ssh_connection, "mender-orchestrator-support")
-            setup_tester_ssh_connection.run(
-                "test -x /usr/share/mender/inventory/mender-inventory-orchestrator-inventory"
-            )
-            setup_tester_ssh_connection.run(
-                "test -x /usr/share/mender/modules/v3/mender-orchestrator-manifest"
-            )
-            setup_tester_ssh_connection.run(
-                "test -x /usr/share/mender-orchestrator/interfaces/v1/rootfs-image"
-            )
 
             # mender-orchestrator-demo
             upload_deb_package(
@@ -100,18 +130,6 @@ class TestPackageOrchestratorSplit:
                 )
             )
             check_installed(setup_tester_ssh_connection, "mender-orchestrator-support")
-            setup_tester_ssh_connection.run(
-                "test -f /data/mender-orchestrator/topology.yaml"
-            )
-            setup_tester_ssh_connection.run(
-                "test -d /data/mender-orchestrator/mock-instances/0"
-            )
-            setup_tester_ssh_connection.run(
-                "test -d /data/mender-orchestrator/mock-instances/1"
-            )
-            setup_tester_ssh_connection.run(
-                "test -d /data/mender-orchestrator/mock-instances/2"
-            )
 
         finally:
             setup_tester_ssh_connection.run(
@@ -119,7 +137,7 @@ class TestPackageOrchestratorSplit:
             )
 
 
-@pytest.mark.usefixtures("setup_mender_configured")
+@pytest.mark.usefixtures("mender_configured_device")
 class TestPackageOrchestratorMeta:
     @pytest.mark.commercial
     def test_mender_orchestrator_meta_package(
@@ -127,41 +145,42 @@ class TestPackageOrchestratorMeta:
     ):
         try:
             # Upload all the packages (including the demo one)
-            for pkg in [
-                "mender-orchestrator",
-                "mender-orchestrator-core",
-            ]:
-                upload_deb_package(
-                    setup_tester_ssh_connection,
-                    mender_dist_packages_versions["mender-orchestrator"],
-                    pkg,
+            paths = [
+                package_filename_path(
+                    mender_dist_packages_versions["mender-orchestrator"], pkg
                 )
-            for pkg in [
-                "mender-orchestrator-support",
-                "mender-orchestrator-demo",
-            ]:
-                upload_deb_package(
-                    setup_tester_ssh_connection,
+                for pkg in ["mender-orchestrator", "mender-orchestrator-core"]
+            ] + [
+                package_filename_path(
                     mender_dist_packages_versions["mender-orchestrator-support"],
                     pkg,
                     "all",
                 )
-
-            setup_tester_ssh_connection.run("mkdir -p /packages; mv *.deb /packages/")
-            prepare_local_apt_repo(setup_tester_ssh_connection, "/packages")
+                for pkg in [
+                    "mender-orchestrator-support",
+                    "mender-orchestrator-demo",
+                ]
+            ]
+            stage_deb_packages(
+                setup_tester_ssh_connection,
+                paths + [packages_index(paths)],
+                dest="/packages",
+            )
+            enable_local_apt_repo(setup_tester_ssh_connection, "/packages")
 
             # Install the meta-package only
             setup_tester_ssh_connection.run(
                 "sudo apt install --assume-yes mender-orchestrator",
             )
 
-            check_installed(setup_tester_ssh_connection, "mender-orchestrator")
-            check_installed(setup_tester_ssh_connection, "mender-orchestrator-core")
-            check_installed(setup_tester_ssh_connection, "mender-orchestrator-support")
-            check_installed(
+            check_installed_many(
                 setup_tester_ssh_connection,
-                "mender-orchestrator-demo",
-                installed=False,
+                {
+                    "mender-orchestrator": True,
+                    "mender-orchestrator-core": True,
+                    "mender-orchestrator-support": True,
+                    "mender-orchestrator-demo": False,
+                },
             )
 
         finally:
@@ -170,10 +189,7 @@ class TestPackageOrchestratorMeta:
             )
 
 
-# Keep this test at the end. Due to reusing the environment through the tests,
-# after we remove a given version of mender-update (but keeping mender-auth)
-# further tests will refuse downgrading.
-@pytest.mark.usefixtures("setup_mender_configured")
+@pytest.mark.usefixtures("mender_configured_device")
 class TestPackageOrchestratorCore:
     @pytest.mark.commercial
     def test_mender_orchestrator_standalone(
@@ -15,7 +15,12 @@
 
 import pytest
 
-from helpers import package_filename, upload_deb_package, check_installed
+from helpers import (
+    package_filename,
+    upload_deb_package,
+    check_installed,
+    verify_remote_files,
+)
 from mender_test_containers.helpers import *
 
 pytestmark = pytest.mark.requires_option("--mender-setup-deb-version")
@@ -40,9 +45,14 @@ class TestPackageSetup:
             ),
         )
         check_installed(setup_tester_ssh_connection, "mender-setup")
-        setup_tester_ssh_connection.run("test -x /usr/bin/mender-setup")
-        setup_tester_ssh_connection.run("test -f /etc/mender/mender.conf")
-        setup_tester_ssh_connection.run("test -f /var/lib/mender/device_type")
+        verify_remote_files(
+            setup_tester_ssh_connection,
+            [
+                {"name": "/usr/bin/mender-setup", "type": "executable"},
+                {"name": "/etc/mender/mender.conf", "type": "file"},
+                {"name": "/var/lib/mender/device_type", "type": "file"},
+            ],
+        )
 
         # Default setup expects ServerURL hosted.mender.io
         result = setup_tester_ssh_connection.sudo("cat /etc/mender/mender.conf")
@@ -61,14 +71,24 @@ class TestPackageSetup:
             + ")"
             in result.stdout
         )
-        setup_tester_ssh_connection.run("test ! -x /usr/bin/mender-setup")
-        setup_tester_ssh_connection.run("test -f /etc/mender/mender.conf")
-        setup_tester_ssh_connection.run("test -f /var/lib/mender/device_type")
+        verify_remote_files(
+            setup_tester_ssh_connection,
+            [
+                {"name": "/usr/bin/mender-setup", "type": "missing"},
+                {"name": "/etc/mender/mender.conf", "type": "file"},
+                {"name": "/var/lib/mender/device_type", "type": "file"},
+            ],
+        )
 
         # Purging mender-setup does not remove the configuration
         setup_tester_ssh_connection.run("sudo dpkg --purge mender-setup")
-        setup_tester_ssh_connection.run("test -f /etc/mender/mender.conf")
-        setup_tester_ssh_connection.run("test -f /var/lib/mender/device_type")
+        verify_remote_files(
+            setup_tester_ssh_connection,
+            [
+                {"name": "/etc/mender/mender.conf", "type": "file"},
+                {"name": "/var/lib/mender/device_type", "type": "file"},
+            ],
+        )
 
         # Re-install the package using the following flow for the setup wizard:
         # ...
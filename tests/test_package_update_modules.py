@@ -20,7 +20,7 @@ from helpers import package_filename, upload_deb_package, check_installed
 pytestmark = pytest.mark.requires_option("--mender-container-modules-deb-version")
 
 
-@pytest.mark.usefixtures("setup_mender_configured")
+@pytest.mark.usefixtures("mender_configured_device")
 class TestPackageUpdateModules:
     def test_mender_container_modules(
         self, setup_tester_ssh_connection, mender_dist_packages_versions